@@ -0,0 +1,138 @@
+"""Batched players.
+
+A batch player takes a list of (game, state) pairs, from as many games,
+and returns the move of each at once, so a decision that can be vectorized
+is made once per batch instead of once per state.  batched() turns any
+(game, state) player into one, unbatched() goes the other way, and
+play_batched runs many games side by side, handing each batch player all
+the states waiting for it at every step.
+
+QTableBatchPlayer and EvalGreedyBatchPlayer are native: the first looks
+up every candidate (state, action) of the batch in one get_many call, the
+second scores every candidate position with one features.batch_eval."""
+import numpy as np
+from bitdomino import converte_estado, converte_move
+from domino import Domino
+from features import batch_eval
+from qlearning import convertaction
+from qtable import codifica
+from simulate import joga
+
+
+def batched(player):
+    """Batch player calling a (game, state) player on each pair."""
+    def batch(pares):
+        return [player(game, state) for game, state in pares]
+    return batch
+
+
+def unbatched(batch):
+    """(game, state) player asking a batch player about one pair."""
+    def player(game, state):
+        return batch([(game, state)])[0]
+    return player
+
+
+def melhores(scores, inicio):
+    """Index of the first best score of each group of consecutive scores,
+    the groups starting at inicio."""
+    grupo = np.repeat(np.arange(len(inicio)), np.diff(np.append(inicio, len(scores))))
+    ordem = np.lexsort((-scores, grupo))
+    return ordem[inicio]
+
+
+def eval_greedy_player(game, state):
+    """Move whose result has the best game.eval for the player to move."""
+    player = state.to_move
+    return max(state.moves, key=lambda move: game.eval(game.result(state, move, player), player))
+
+
+class EvalGreedyBatchPlayer:
+    """Batch version of eval_greedy_player: every move of every state is
+    applied on bit masks and scored by a single batch_eval."""
+
+    def __call__(self, pares):
+        res = [None] * len(pares)
+        mao, restantes, ponta1, ponta2, tile, lado, player = [], [], [], [], [], [], []
+        inicio, quais = [], []
+        for j, (game, state) in enumerate(pares):
+            if not state.moves:
+                continue
+            bits = converte_estado(state)
+            inicio.append(len(mao))
+            quais.append(j)
+            for move in state.moves:
+                t, l = converte_move(move)
+                mao.append(bits.pedras)
+                restantes.append(bits.pedras_restantes)
+                ponta1.append(-1 if bits.ponta1 is None else bits.ponta1)
+                ponta2.append(-1 if bits.ponta2 is None else bits.ponta2)
+                tile.append(t)
+                lado.append(l)
+                player.append(state.to_move)
+        if not quais:
+            return res
+        mao, tile, lado = np.array(mao), np.array(tile), np.array(lado)
+        ponta1, ponta2 = np.array(ponta1), np.array(ponta2)
+        joga_pedra = tile >= 0
+        novo1, novo2 = joga(np.maximum(tile, 0), lado, ponta1, ponta2)
+        mao = np.where(joga_pedra, mao & ~(np.int64(1) << np.maximum(tile, 0)), mao)
+        scores = batch_eval(mao, np.array(restantes), np.where(joga_pedra, novo1, ponta1),
+                            np.where(joga_pedra, novo2, ponta2), np.array(player))
+        inicio = np.array(inicio)
+        for j, k in zip(quais, (melhores(scores, inicio) - inicio).tolist()):
+            res[j] = pares[j][1].moves[k]
+        return res
+
+
+class QTableBatchPlayer:
+    """Greedy batch player over a learned Q-table: the move of highest
+    Q(mdp.convert(state), action), read for the whole batch with one
+    get_many when Q has it (qtable.PackedTable, qstore.QStore) and with
+    Q.get otherwise."""
+
+    def __init__(self, mdp, Q):
+        self.mdp = mdp
+        self.Q = Q
+
+    def __call__(self, pares):
+        res = [None] * len(pares)
+        chaves, inicio, quais = [], [], []
+        for j, (game, state) in enumerate(pares):
+            if not state.moves:
+                continue
+            s = self.mdp.convert(state)
+            inicio.append(len(chaves))
+            quais.append(j)
+            chaves.extend((s, convertaction(a)) for a in state.moves)
+        if not quais:
+            return res
+        if hasattr(self.Q, 'get_many'):
+            scores = self.Q.get_many(np.array([codifica(k) for k in chaves], dtype=np.int64))
+        else:
+            scores = np.array([self.Q.get(k, 0.0) for k in chaves], dtype=np.float64)
+        inicio = np.array(inicio)
+        for j, k in zip(quais, (melhores(scores, inicio) - inicio).tolist()):
+            res[j] = pares[j][1].moves[k]
+        return res
+
+
+def play_batched(n, *players):
+    """Play n games side by side, one batch player per seat (or one for
+    all), and return the winner of each."""
+    if len(players) == 1:
+        players = players * 4
+    jogos = [Domino() for i in range(n)]
+    states = [d.initial for d in jogos]
+    vencedores = [-1] * n
+    ativos = list(range(n))
+    while ativos:
+        for seat in range(4):
+            vez = [g for g in ativos if states[g].to_move == seat]
+            if not vez:
+                continue
+            moves = players[seat]([(jogos[g], states[g]) for g in vez])
+            for g, move in zip(vez, moves):
+                vencedores[g], states[g] = jogos[g].avanca(states[g], move, recalcula=False)
+        ativos = [g for g in ativos if vencedores[g] == -1]
+    return vencedores
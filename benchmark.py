@@ -0,0 +1,189 @@
+"""Reproducible throughput benchmarks.
+
+Every run deals the same positions from fixed seeds and measures:
+
+    search.<name>.depth<d>   nodes/sec of alphabeta_search and expectiminimax
+                             at each depth, from the node count in info
+                             (moves applied plus leaf evaluations)
+    domino.result, .moves    Domino.result and Domino.moves calls/sec
+    games.random             play_game_mdp games/sec with four random players
+    qlearning.updates        QLearningAgent Q-updates/sec in self-play
+
+Every metric is the median of repeat runs.  Results are written as JSON.
+Given a baseline file from an earlier run, each metric is reported as a
+ratio to it and the exit status is 1 when any metric fell by more than the
+tolerance, 30% by default, as timings on a shared machine easily move by
+20%:
+
+    python benchmark.py --out base.json
+    python benchmark.py --baseline base.json --out new.json"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+from statistics import median
+import numpy as np
+from domino import Domino, alphabeta_search, expectiminimax
+from mdp import DominoMDP
+from qlearning import QLearningAgent, alpha_padrao, play_game_mdp, random_player
+
+SEED = 2024
+
+
+def semeia(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def posicoes(n, seed=SEED):
+    """n mid-game (Domino, GameState) pairs reached by random play from
+    seeded deals, each seen by the player to move."""
+    semeia(seed)
+    res = []
+    while len(res) < n:
+        d = Domino()
+        state = d.initial
+        for j in range(random.randint(0, 12)):
+            vencedor, state = d.avanca(state, random.choice(state.moves))
+            if vencedor != -1:
+                break
+            state = state._replace(utility=0)
+        else:
+            if len(state.pedras_restantes) > 3:
+                res.append((d, state))
+    return res
+
+
+def bench_search(pos, depths, repeat):
+    """Nodes/sec of each search at each depth over the positions, the
+    median of repeat runs after an untimed one."""
+    res = {}
+    for nome, search in (('alphabeta', lambda d, s, **kw: alphabeta_search(s, d, **kw)),
+                         ('expectiminimax', expectiminimax)):
+        for depth in depths[nome]:
+            for d, state in pos:
+                search(d, state, depth=depth)
+            taxas = []
+            for r in range(repeat):
+                nodes = 0
+                inicio = time.perf_counter()
+                for d, state in pos:
+                    info = {}
+                    search(d, state, depth=depth, info=info)
+                    nodes += info.get('nodes', 0)
+                taxas.append(nodes / (time.perf_counter() - inicio))
+            res['search.%s.depth%d' % (nome, depth)] = median(taxas)
+    return res
+
+
+def bench_domino(pos, repeat):
+    """Domino.result and Domino.moves calls/sec over every move of the
+    positions, the median of repeat runs."""
+    tempos_result, tempos_moves = [], []
+    chamadas = sum(len(state.moves) for d, state in pos)
+    for r in range(repeat):
+        inicio = time.perf_counter()
+        for d, state in pos:
+            for move in state.moves:
+                d.result(state, move, state.to_move)
+        tempos_result.append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        for d, state in pos:
+            for move in state.moves:
+                d.moves(state.to_move, state.pedras, state.pedras_restantes, state.ponta1, state.ponta2,
+                        state.to_move)
+        tempos_moves.append(time.perf_counter() - inicio)
+    return {'domino.result': chamadas / median(tempos_result), 'domino.moves': chamadas / median(tempos_moves)}
+
+
+def bench_games(n, repeat, seed=SEED):
+    """play_game_mdp games/sec with four random players, the median of
+    repeat runs of the same games."""
+    taxas = []
+    for r in range(repeat):
+        semeia(seed)
+        mdp = DominoMDP(Domino(), 0)
+        inicio = time.perf_counter()
+        for i in range(n):
+            play_game_mdp(mdp, random_player, random_player, random_player, random_player)
+        taxas.append(n / (time.perf_counter() - inicio))
+    return {'games.random': median(taxas)}
+
+
+def bench_qlearning(n, repeat, seed=SEED):
+    """Q-updates/sec of a QLearningAgent playing all four seats, the
+    median of repeat runs from a fresh agent."""
+    taxas = []
+    for r in range(repeat):
+        semeia(seed)
+        mdp = DominoMDP(Domino(), 0)
+        agent = QLearningAgent(mdp, Ne=5, Rplus=4, Q=defaultdict(float), alpha=alpha_padrao)
+        inicio = time.perf_counter()
+        for i in range(n):
+            play_game_mdp(mdp, agent, agent, agent, agent)
+        gasto = time.perf_counter() - inicio
+        taxas.append(sum(agent.Nsa.values()) / gasto)
+    return {'qlearning.updates': median(taxas)}
+
+
+def run(quick=False, repeat=5):
+    """Run every benchmark and return {metric: rate}."""
+    pos = posicoes(6 if quick else 20)
+    depths = {'alphabeta': range(1, 5 if quick else 7), 'expectiminimax': range(1, 4 if quick else 6)}
+    res = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        res.update(bench_search(pos, depths, repeat))
+        res.update(bench_domino(posicoes(50 if quick else 200), repeat))
+        res.update(bench_games(50 if quick else 300, repeat))
+        res.update(bench_qlearning(50 if quick else 300, repeat))
+    return res
+
+
+def compara(res, baseline, tolerancia):
+    """Ratio of every metric to the baseline and the metrics that fell
+    below 1 - tolerancia."""
+    razoes = {k: v / baseline[k] for k, v in res.items() if baseline.get(k)}
+    regressoes = sorted(k for k, r in razoes.items() if r < 1 - tolerancia)
+    return razoes, regressoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed slowdown before failing')
+    parser.add_argument('--quick', action='store_true', help='fewer positions and shallower searches')
+    parser.add_argument('--repeat', type=int, default=5, help='repeats of every benchmark, median kept')
+    args = parser.parse_args(argv)
+
+    res = run(args.quick, args.repeat)
+    saida = {'meta': {'seed': SEED, 'quick': args.quick, 'python': platform.python_version(),
+                      'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+             'results': res}
+    regressoes = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        razoes, regressoes = compara(res, baseline, args.tolerance)
+        saida['ratios'] = razoes
+        saida['regressions'] = regressoes
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(saida, f, indent=2, sort_keys=True)
+    for k in sorted(res):
+        linha = '%-32s %12.1f' % (k, res[k])
+        if args.baseline and k in saida['ratios']:
+            linha += '  x%.2f' % saida['ratios'][k]
+            if k in regressoes:
+                linha += '  REGRESSION'
+        print(linha)
+    return 1 if regressoes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
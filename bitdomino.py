@@ -0,0 +1,441 @@
+"""Compact bitmask engine for the double-six Domino set.
+
+The 28 tiles get a fixed index (the same order as Domino.cria_domino), and
+every hand, the pool of unseen tiles and the set of played tiles is a 28-bit
+integer.  Per-pip masks turn move generation, utility and victory checks
+into a handful of AND/popcount operations."""
+import numpy as np
+from Game import StochasticGame
+from collections import namedtuple
+from transposition import ZOBRIST_PEDRA, ZOBRIST_VEZ, chave_pontas, chave_zobrist
+
+PEDRAS = [(i, j) for i in range(7) for j in range(7) if i >= j]
+N_PEDRAS = len(PEDRAS)
+TODAS = (1 << N_PEDRAS) - 1
+
+INDICE = {}
+for _k, (_a, _b) in enumerate(PEDRAS):
+    INDICE[_a, _b] = _k
+    INDICE[_b, _a] = _k
+
+VALOR = [a + b for (a, b) in PEDRAS]
+NAIPE = [0] * 7
+for _k, (_a, _b) in enumerate(PEDRAS):
+    NAIPE[_a] |= 1 << _k
+    NAIPE[_b] |= 1 << _k
+BUCHAS = sum(1 << k for k, (a, b) in enumerate(PEDRAS) if a == b)
+
+PASSE = (-1, -1)
+
+# Lookup tables over 7-bit chunks of a mask: 4 lookups cover the 28 tiles.
+_BLOCO = 7
+_SOMA = [[sum(VALOR[c * _BLOCO + i] for i in range(_BLOCO) if m >> i & 1)
+          for m in range(1 << _BLOCO)] for c in range(4)]
+_PESO_BUCHA = [(a or 1) if a == b else 0 for (a, b) in PEDRAS]
+_BUCHAS = [[sum(_PESO_BUCHA[c * _BLOCO + i] for i in range(_BLOCO) if m >> i & 1)
+            for m in range(1 << _BLOCO)] for c in range(4)]
+
+# Moves of the tiles of each chunk, played on end -1, 0 or 1.
+_MOVES = {lado: [[tuple((c * _BLOCO + i, lado) for i in range(_BLOCO) if m >> i & 1)
+                  for m in range(1 << _BLOCO)] for c in range(4)] for lado in (-1, 0, 1)}
+
+BitGameState = namedtuple('BitGameState', 'to_move,pedras,pedras_restantes,mesa,ponta1,ponta2,moves,utility')
+
+
+def conta(mascara):
+    """Number of tiles in a mask."""
+    return bin(mascara).count('1')
+
+
+def indices(mascara):
+    """Indices of the tiles in a mask, in increasing order."""
+    res = []
+    while mascara:
+        bit = mascara & -mascara
+        res.append(bit.bit_length() - 1)
+        mascara ^= bit
+    return res
+
+
+def soma(mascara):
+    """Sum of the pips of every tile in a mask."""
+    return (_SOMA[0][mascara & 0x7f] + _SOMA[1][mascara >> 7 & 0x7f] +
+            _SOMA[2][mascara >> 14 & 0x7f] + _SOMA[3][mascara >> 21 & 0x7f])
+
+
+def peso_buchas(mascara):
+    """Weighted doubles of a mask, as in Domino.buchas."""
+    return (_BUCHAS[0][mascara & 0x7f] + _BUCHAS[1][mascara >> 7 & 0x7f] +
+            _BUCHAS[2][mascara >> 14 & 0x7f] + _BUCHAS[3][mascara >> 21 & 0x7f])
+
+
+def diversidade(mascara):
+    """Number of distinct pips present in a mask."""
+    res = 0
+    for naipe in NAIPE:
+        if mascara & naipe:
+            res += 1
+    return res
+
+
+def mascara(pedras):
+    """Mask of a list of Pedra objects or (a, b) tuples."""
+    res = 0
+    for pedra in pedras:
+        valor = pedra.valor if hasattr(pedra, 'valor') else pedra
+        res |= 1 << INDICE[valor[0], valor[1]]
+    return res
+
+
+def pontas_abertas(ponta1, ponta2):
+    """Open pips of the two ends of a GameState, or (None, None)."""
+    if ponta1 is None:
+        return None, None
+    p1 = ponta1.valor[0] if ponta1.position == -1 else ponta1.valor[ponta1.position]
+    p2 = ponta2.valor[1] if ponta2.position == -1 else ponta2.valor[ponta2.position]
+    return p1, p2
+
+
+def converte_estado(state):
+    """Convert a GameState into the equivalent BitGameState."""
+    pedras = mascara(state.pedras)
+    pedras_restantes = mascara(state.pedras_restantes)
+    ponta1, ponta2 = pontas_abertas(state.ponta1, state.ponta2)
+    return BitGameState(to_move=state.to_move, pedras=pedras, pedras_restantes=pedras_restantes,
+                        mesa=TODAS & ~(pedras | pedras_restantes), ponta1=ponta1, ponta2=ponta2,
+                        moves=None, utility=state.utility)
+
+
+def converte_move(move):
+    """Convert a (Pedra, ponta) move into a (tile index, ponta) move."""
+    if move[0].valor[0] == -1:
+        return PASSE
+    return INDICE[move[0].tupla()], move[1]
+
+
+def lista_moves(mascara, lado):
+    """Tuple of the (tile index, lado) moves of every tile in a mask."""
+    tabela = _MOVES[lado]
+    return (tabela[0][mascara & 0x7f] + tabela[1][mascara >> 7 & 0x7f] +
+            tabela[2][mascara >> 14 & 0x7f] + tabela[3][mascara >> 21 & 0x7f])
+
+
+def gera_moves(mao, ponta1, ponta2):
+    """Legal (tile index, ponta) moves of a hand against the open ends.
+    NAIPE is the per-pip index of the hand, so each end is one lookup.  A
+    tile holding both open pips may go on either end, except when both ends
+    show the same pip, where it is listed once."""
+    if ponta1 is None:
+        moves = list(lista_moves(mao, -1))
+    else:
+        moves = list(lista_moves(mao & NAIPE[ponta1], 0))
+        if ponta2 != ponta1:
+            moves += lista_moves(mao & NAIPE[ponta2], 1)
+    if not moves:
+        moves.append(PASSE)
+    return moves
+
+
+def joga(pedra, ponta1, ponta2, lado):
+    """Open ends after placing tile index pedra on the given side."""
+    a, b = PEDRAS[pedra]
+    if ponta1 is None:
+        return a, b
+    if lado == 0:
+        return (b if a == ponta1 else a), ponta2
+    return ponta1, (b if a == ponta2 else a)
+
+
+# Weights of the eval terms (buchas, n_pedras, delta, mov, soma,
+# diversidade) for players 0 to 3.
+PESOS = [(-0.9, -0.2, 0.7, 0.5, -0.4, 0.6),
+         (-0.9, -0.2, 0.7, 0.5, -0.4, 0.6),
+         (-0.9, -0.2, 0.7, 0.0, -0.4, 0.0),
+         (0.0, 0.0, 0.0, 0.5, 0.0, 0.6)]
+
+
+def avalia(state, player):
+    """Domino.eval on anything with mask pedras/pedras_restantes and pip ends."""
+    n = conta(state.pedras)
+    m = conta(state.pedras_restantes) / 3
+    buchas = peso_buchas(state.pedras)
+    delta = m - n
+    soma_pedras = soma(state.pedras)
+    div = diversidade(state.pedras)
+    if state.ponta1 is None:
+        mov = max(n, 1)
+    else:
+        mov = max(conta(state.pedras & (NAIPE[state.ponta1] | NAIPE[state.ponta2])), 1)
+    if player <= 1:
+        return -0.9 * buchas - 0.2 * n + 0.7 * delta + 0.5 * mov - 0.4 * soma_pedras + 0.6 * div
+    if player == 2:
+        return -0.9 * buchas - 0.2 * n + 0.7 * delta - 0.4 * soma_pedras
+    if player == 3:
+        return 0.5 * mov + 0.6 * div
+
+
+def limites_eval(state, player, proprias=7, outras=21):
+    """Lowest and highest avalia of any position reached from state after
+    at most proprias tiles leave the hand and outras leave the pool.  Each
+    term is bounded on its own, so the bounds are safe but not tight."""
+    n = conta(state.pedras)
+    r = conta(state.pedras_restantes)
+    a = min(proprias, n)
+    b = min(outras, r)
+    buchas = peso_buchas(state.pedras)
+    valores = soma(state.pedras)
+    div = diversidade(state.pedras)
+    perda_buchas = perda_valores = 0
+    if a:
+        mao = indices(state.pedras)
+        perda_buchas = sum(sorted((_PESO_BUCHA[k] for k in mao), reverse=True)[:a])
+        perda_valores = sum(sorted((VALOR[k] for k in mao), reverse=True)[:a])
+    faixas = [(buchas - perda_buchas, buchas),
+              (n - a, n),
+              ((r - b) / 3 - n, r / 3 - (n - a)),
+              (1, max(n, 1)),
+              (valores - perda_valores, valores),
+              (max(div - 2 * a, 0), div)]
+    baixo = alto = 0.0
+    for peso, (x, y) in zip(PESOS[player], faixas):
+        baixo += min(peso * x, peso * y)
+        alto += max(peso * x, peso * y)
+    return baixo, alto
+
+
+def calcula_utility(to_move, pedras, pedras_restantes, ponta1, ponta2, move, player):
+    """Domino.compute_utility on masks."""
+    if move[0] == -1 and ponta1 is not None:
+        outros = pedras_restantes if to_move == player else pedras
+        if outros & (NAIPE[ponta1] | NAIPE[ponta2]):
+            return 0
+        return -1 if to_move != 0 else 4
+    elif move[0] != -1:
+        if to_move == player:
+            return 4 if conta(pedras) == 1 else 0
+        return -1 if conta(pedras_restantes) == 3 else 0
+    else:
+        return -1
+
+
+def separa_chances(oponente, moves, n_pedras, n_restantes):
+    """Domino.chances: an opponent plays on ponta1, on ponta2 or passes.
+    chance[2] is the number of pool tiles behind the chance: for an end,
+    the tiles listed on it, a tile listed on both ends counting half on
+    each; for a pass, every distinct playable tile."""
+    if oponente:
+        lista = []
+        p1 = [m for m in moves if m[1] == 0]
+        p2 = [m for m in moves if m[1] == 1]
+        ambas = len({m[0] for m in p1} & {m[0] for m in p2})
+        if p1:
+            lista.append((1, p1, len(p1) - ambas / 2, n_restantes))
+        if p2:
+            lista.append((2, p2, len(p2) - ambas / 2, n_restantes))
+        lista.append((-1, [PASSE], len(p1) + len(p2) - ambas, n_restantes))
+        return lista
+    return [(0, moves, len(moves), n_pedras)]
+
+
+def probabilidade(chance):
+    """Domino.probability of a chance built by separa_chances."""
+    if chance[0] == 1 or chance[0] == 2:
+        return chance[2] / chance[3]
+    elif chance[0] == -1:
+        return 1 - (chance[2] / chance[3])
+    return 1
+
+
+class Board:
+    """A mutable BitDomino position seen by player, for searches that play
+    moves in place with apply(move) and take them back with undo().  The
+    position only holds integers, so nothing is shared with other states.
+    chave is its Zobrist key, kept up to date by apply and undo, and nos
+    counts the moves applied so far."""
+
+    def __init__(self, state, player):
+        self.player = player
+        self.to_move = state.to_move
+        self.pedras = state.pedras
+        self.pedras_restantes = state.pedras_restantes
+        self.mesa = state.mesa
+        self.ponta1 = state.ponta1
+        self.ponta2 = state.ponta2
+        self.utility = state.utility
+        self.chave = chave_zobrist(state, player)
+        self.pilha = []
+        self.nos = 0
+
+    def moves(self):
+        if self.to_move == self.player:
+            return gera_moves(self.pedras, self.ponta1, self.ponta2)
+        return gera_moves(self.pedras_restantes, self.ponta1, self.ponta2)
+
+    def chances(self, moves):
+        return separa_chances(self.to_move != self.player, moves,
+                              conta(self.pedras), conta(self.pedras_restantes))
+
+    def apply(self, move):
+        utility = calcula_utility(self.to_move, self.pedras, self.pedras_restantes,
+                                  self.ponta1, self.ponta2, move, self.player)
+        self.pilha.append((move, self.ponta1, self.ponta2, self.utility, self.chave))
+        self.nos += 1
+        chave = self.chave ^ ZOBRIST_VEZ[self.to_move]
+        if move[0] != -1:
+            bit = 1 << move[0]
+            chave ^= chave_pontas(self.ponta1, self.ponta2)
+            self.ponta1, self.ponta2 = joga(move[0], self.ponta1, self.ponta2, move[1])
+            chave ^= chave_pontas(self.ponta1, self.ponta2)
+            if self.to_move == self.player:
+                self.pedras &= ~bit
+                chave ^= ZOBRIST_PEDRA[0][move[0]]
+            else:
+                self.pedras_restantes &= ~bit
+                chave ^= ZOBRIST_PEDRA[1][move[0]]
+            self.mesa |= bit
+        self.utility = utility
+        self.to_move = (self.to_move + 1) % 4
+        self.chave = chave ^ ZOBRIST_VEZ[self.to_move]
+
+    def undo(self):
+        move, self.ponta1, self.ponta2, self.utility, self.chave = self.pilha.pop()
+        self.to_move = (self.to_move - 1) % 4
+        if move[0] != -1:
+            bit = 1 << move[0]
+            if self.to_move == self.player:
+                self.pedras |= bit
+            else:
+                self.pedras_restantes |= bit
+            self.mesa &= ~bit
+
+    def state(self):
+        """Immutable snapshot of the current position."""
+        return BitGameState(to_move=self.to_move, pedras=self.pedras, pedras_restantes=self.pedras_restantes,
+                            mesa=self.mesa, ponta1=self.ponta1, ponta2=self.ponta2,
+                            moves=self.moves(), utility=self.utility)
+
+
+class BitDomino(StochasticGame):
+    """Domino played on BitGameState masks.  Moves are (tile index, ponta)
+    pairs and PASSE is the pass move.  States are immutable, so result is a
+    persistent transition; Board is the in-place one.  A Domino instance can
+    be given to reuse its deal."""
+
+    def __init__(self, domino=None):
+        if domino is None:
+            self.jogadores = self.escolhe_pedras()
+        else:
+            self.jogadores = [mascara(jogador) for jogador in domino.jogadores]
+        pedras_restantes = self.jogadores[1] | self.jogadores[2] | self.jogadores[3]
+        self.initial = BitGameState(to_move=0, pedras=self.jogadores[0], pedras_restantes=pedras_restantes,
+                                    mesa=0, ponta1=None, ponta2=None,
+                                    moves=gera_moves(self.jogadores[0], None, None), utility=0)
+
+    def reset(self):
+        self.__init__()
+
+    def escolhe_pedras(self):
+        ordem = np.random.permutation(N_PEDRAS)
+        jogadores = [0] * 4
+        for j in range(4):
+            for k in ordem[7 * j:7 * j + 7]:
+                jogadores[j] |= 1 << int(k)
+        return jogadores
+
+    def actions(self, state):
+        return state.moves
+
+    def moves(self, to_move, pedras, pedras_restantes, ponta1, ponta2, player):
+        return gera_moves(pedras if to_move == player else pedras_restantes, ponta1, ponta2)
+
+    def eval(self, state, player):
+        return avalia(state, player)
+
+    def compute_utility(self, to_move, pedras, pedras_restantes, ponta1, ponta2, move, player):
+        return calcula_utility(to_move, pedras, pedras_restantes, ponta1, ponta2, move, player)
+
+    def utility(self, state, player):
+        return state.utility
+
+    def terminal_test(self, state):
+        return state.utility != 0
+
+    def result(self, state, move, player):
+        utility = self.compute_utility(state.to_move, state.pedras, state.pedras_restantes,
+                                       state.ponta1, state.ponta2, move, player)
+        pedras, pedras_restantes, mesa = state.pedras, state.pedras_restantes, state.mesa
+        ponta1, ponta2 = state.ponta1, state.ponta2
+        if move[0] != -1:
+            bit = 1 << move[0]
+            ponta1, ponta2 = joga(move[0], ponta1, ponta2, move[1])
+            if state.to_move == player:
+                pedras &= ~bit
+            else:
+                pedras_restantes &= ~bit
+            mesa |= bit
+        to_move = (state.to_move + 1) % 4
+        return BitGameState(to_move=to_move, pedras=pedras, pedras_restantes=pedras_restantes, mesa=mesa,
+                            ponta1=ponta1, ponta2=ponta2,
+                            moves=self.moves(to_move, pedras, pedras_restantes, ponta1, ponta2, player),
+                            utility=utility)
+
+    def chances(self, state, player=0):
+        """Domino.chances: the seats other than player are opponents."""
+        return separa_chances(state.to_move != player, state.moves, conta(state.pedras),
+                              conta(state.pedras_restantes))
+
+    def probability(self, chance):
+        return probabilidade(chance)
+
+    def outcome(self, state, chance):
+        return state._replace(moves=chance[1])
+
+    def pode_jogar(self, i, state):
+        if state.ponta1 is None:
+            return True
+        return bool(self.jogadores[i] & (NAIPE[state.ponta1] | NAIPE[state.ponta2]))
+
+    def menor_soma(self):
+        return min(range(4), key=lambda i: soma(self.jogadores[i]))
+
+    def vitoria(self, state):
+        for i in range(4):
+            if not self.jogadores[i]:
+                return i
+        for i in range(4):
+            if self.pode_jogar(i, state):
+                return -1
+        return self.menor_soma()
+
+    def display(self, state):
+        print("To move: ", state.to_move)
+        print("Ponta 1 = ", state.ponta1, " Ponta 2 = ", state.ponta2)
+        print("Pedras ", [PEDRAS[k] for k in indices(state.pedras)])
+        print("Restantes ", [PEDRAS[k] for k in indices(state.pedras_restantes)])
+        print("Moves ", [(PEDRAS[k] if k != -1 else None, lado) for (k, lado) in state.moves])
+        print("Utilidade ", state.utility)
+
+    def play_game(self, *players):
+        """Play an n-person, move-alternating game."""
+        state = self.initial
+        while True:
+            for player in players:
+                move = player(self, state)
+                if move[0] != -1:
+                    self.jogadores[state.to_move] &= ~(1 << move[0])
+                state_res = self.result(state, move, state.to_move)
+                vencedor = self.vitoria(state_res)
+                if vencedor != -1:
+                    return vencedor
+                to_move = state_res.to_move
+                pedras = self.jogadores[to_move]
+                pedras_restantes = 0
+                for i in range(4):
+                    if i != to_move:
+                        pedras_restantes |= self.jogadores[i]
+                state = BitGameState(to_move=to_move, pedras=pedras, pedras_restantes=pedras_restantes,
+                                     mesa=state_res.mesa, ponta1=state_res.ponta1, ponta2=state_res.ponta2,
+                                     moves=gera_moves(pedras, state_res.ponta1, state_res.ponta2),
+                                     utility=self.compute_utility(to_move, pedras, pedras_restantes,
+                                                                  state_res.ponta1, state_res.ponta2,
+                                                                  move, to_move))
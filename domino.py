@@ -1,59 +1,258 @@
 import numpy as np
 from Game import Game, StochasticGame
 from collections import namedtuple
+from functools import partial
 import random
 from utils import argmax, vector_add
+from bitdomino import Board, avalia, converte_estado, converte_move, limites_eval, pontas_abertas, probabilidade
+from transposition import TranspositionTable, ZOBRIST_CHANCE, EXATO, INFERIOR, SUPERIOR
+from ordering import MoveOrdering
 import time
 
 infinity = float('inf')
-GameState = namedtuple('GameState', 'to_move,pedras,pedras_restantes,  ponta1, ponta2, moves, utility')
+_GameState = namedtuple('GameState', 'to_move,pedras,pedras_restantes,  ponta1, ponta2, moves, utility')
 
-def alphabeta_search(state, game):
-    """Search game to determine best action; use alpha-beta pruning.
-    As in [Figure 5.7], this version searches all the way to the leaves."""
 
-    player = game.to_move(state)
-    d = 0
+class _Moves:
+    """GameState.moves: calls a stored function the first time it is read
+    and keeps its list in the instance dict, which shadows this descriptor
+    from then on."""
+
+    def __get__(self, state, cls=None):
+        if state is None:
+            return self
+        moves = tuple.__getitem__(state, 5)
+        if callable(moves):
+            moves = moves()
+        state.__dict__['moves'] = moves
+        return moves
+
+
+class GameState(_GameState):
+    """Domino position.  moves may be given as a function of no arguments,
+    which is called the first time moves is read; its list is kept, so a
+    successor nobody asks for its moves never builds them.  Indexing,
+    iteration, comparison, hashing and pickling all see the list."""
+
+    moves = _Moves()
+
+    def _valores(self):
+        return tuple.__getitem__(self, slice(5)) + (self.moves, tuple.__getitem__(self, 6))
+
+    def __getitem__(self, i):
+        return self._valores()[i]
+
+    def __iter__(self):
+        return iter(self._valores())
+
+    def __eq__(self, other):
+        if isinstance(other, GameState):
+            other = other._valores()
+        return self._valores() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._valores())
+
+    def __repr__(self):
+        return 'GameState(%s)' % ', '.join('%s=%r' % par for par in zip(self._fields, self._valores()))
+
+    def __reduce__(self):
+        return GameState, self._valores()
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when its deadline has passed."""
+
+
+def profundidade(state):
+    """Default search depth for a position, from the size of the hand."""
     n = len(state.pedras)
     if n == 7:
-        d = 7
+        return 7
     elif n <= 6:
-        d = 9
+        return 9
+    return 0
+
+
+def ordena_raiz(actions, pv):
+    """Put the first move of a previous principal variation in front."""
+    if pv:
+        for i, a in enumerate(actions):
+            if converte_move(a) == pv[0]:
+                return [a] + actions[:i] + actions[i+1:]
+    return actions
+
+
+def hash_move_first(moves, entrada):
+    """Put the best move stored in a table slot in front."""
+    if entrada is not None and entrada[4] is not None and entrada[4] in moves:
+        moves.remove(entrada[4])
+        moves.insert(0, entrada[4])
+    return moves
+
+
+def alphabeta_search(state, game, tabela=None, depth=None, deadline=None, pv=None, info=None, ordering=None,
+                     stats=None):
+    """Search game to determine best action; use alpha-beta pruning.
+    As in [Figure 5.7], this version searches all the way to the leaves.
+    The tree is walked with apply/undo on a single Board, and positions
+    already searched deep enough are answered by the transposition table.
+    Past the deadline (a time.time() value) SearchTimeout is raised; info,
+    if given, receives the value, principal variation and node count.
+    ordering, a MoveOrdering, sorts the moves of every node; without it
+    only the table move is tried first.  stats, a SearchStats, counts the
+    work done."""
+
+    player = game.to_move(state)
+    d = profundidade(state) if depth is None else depth
+    board = Board(converte_estado(state), player)
+    if tabela is None:
+        tabela = TranspositionTable()
+    tabela.nova_busca()
+    if ordering is not None:
+        ordering.nova_busca()
+    cortado = [False]
+    avaliar = avalia
+    if stats is not None:
+        stats.start('alphabeta', d)
+        stats.instrumenta(board)
+        avaliar = stats.cronometra('eval', avalia)
+
+    def ordena(entrada, depth):
+        if ordering is None:
+            return hash_move_first(board.moves(), entrada)
+        return ordering.order(board, board.moves(), depth, entrada[4] if entrada is not None else None)
+
+    def probe(alpha, beta, restante):
+        entrada = tabela.probe(board.chave)
+        if entrada is not None and entrada[2] >= restante:
+            if entrada[3] == EXATO:
+                return entrada[1], alpha, beta, entrada
+            if entrada[3] == INFERIOR:
+                alpha = max(alpha, entrada[1])
+            else:
+                beta = min(beta, entrada[1])
+            if alpha >= beta:
+                return entrada[1], alpha, beta, entrada
+        return None, alpha, beta, entrada
+
+    def store(v, alpha, beta, restante, melhor):
+        if v <= alpha:
+            tabela.store(board.chave, v, restante, SUPERIOR, melhor)
+        elif v >= beta:
+            tabela.store(board.chave, v, restante, INFERIOR, melhor)
+        else:
+            tabela.store(board.chave, v, restante, EXATO, melhor)
+
+    proximo = [256]
+
+    def relogio():
+        if deadline is not None and board.nos >= proximo[0]:
+            proximo[0] = board.nos + 256
+            if time.time() > deadline:
+                raise SearchTimeout
+
     # Functions used by alphabeta
-    def max_value(state, alpha, beta,depth):
+    def max_value(alpha, beta, depth):
+        if stats is not None:
+            stats.node(depth)
         if depth >= d:
-            return game.eval(state, player)
-        if game.terminal_test(state):
-            print("terminal")
-            return game.utility(state, player)
+            cortado[0] = True
+            if stats is not None:
+                stats.evals += 1
+            return avaliar(board, player)
+        if board.utility != 0:
+            if stats is not None:
+                stats.terminals += 1
+            return board.utility
+        relogio()
+        alpha0, beta0 = alpha, beta
+        v, alpha, beta, entrada = probe(alpha, beta, d - depth)
+        if v is not None:
+            return v
         v = -infinity
-        for a in game.actions(state):
-            v = max(v, min_value(game.result(state, a,player), alpha, beta, depth+1))
+        melhor = None
+        for i, a in enumerate(ordena(entrada, depth)):
+            board.apply(a)
+            u = min_value(alpha, beta, depth+1)
+            board.undo()
+            if u > v:
+                v, melhor = u, a
             if v >= beta:
-                return v
+                if ordering is not None:
+                    ordering.cutoff(board, a, depth, d - depth, i)
+                if stats is not None:
+                    stats.cutoff(depth)
+                break
             alpha = max(alpha, v)
+        store(v, alpha0, beta0, d - depth, melhor)
         return v
 
-    def min_value(state, alpha, beta,depth):
-        if game.terminal_test(state):
-            return game.utility(state, player)
+    def min_value(alpha, beta, depth):
+        if stats is not None:
+            stats.node(depth)
+        if board.utility != 0:
+            if stats is not None:
+                stats.terminals += 1
+            return board.utility
+        relogio()
+        alpha0, beta0 = alpha, beta
+        v, alpha, beta, entrada = probe(alpha, beta, d - depth)
+        if v is not None:
+            return v
         v = infinity
-        for a in game.actions(state):
-            v = min(v, max_value(game.result(state, a,player), alpha, beta, depth+1))
+        melhor = None
+        for i, a in enumerate(ordena(entrada, depth)):
+            board.apply(a)
+            u = max_value(alpha, beta, depth+1)
+            board.undo()
+            if u < v:
+                v, melhor = u, a
             if v <= alpha:
-                return v
+                if ordering is not None:
+                    ordering.cutoff(board, a, depth, d - depth, i)
+                if stats is not None:
+                    stats.cutoff(depth)
+                break
             beta = min(beta, v)
+        store(v, alpha0, beta0, d - depth, melhor)
         return v
 
+    def variacao(primeiro):
+        linha = [primeiro]
+        board.apply(primeiro)
+        while len(linha) < d and board.utility == 0:
+            entrada = tabela.probe(board.chave)
+            if entrada is None or entrada[4] is None:
+                break
+            linha.append(entrada[4])
+            board.apply(entrada[4])
+        for a in linha:
+            board.undo()
+        return linha
+
     # Body of alphabeta_cutoff_search:
     best_score = -infinity
     beta = infinity
     best_action = None
-    for a in game.actions(state):
-        v = min_value(game.result(state, a,player), best_score, beta,1)
+    actions = game.actions(state)
+    if ordering is not None:
+        actions = sorted(actions, key=lambda a: ordering.score(board, converte_move(a), 0), reverse=True)
+    for a in ordena_raiz(actions, pv):
+        board.apply(converte_move(a))
+        v = min_value(best_score, beta, 1)
+        board.undo()
         if v > best_score:
             best_score = v
             best_action = a
+    if info is not None:
+        info.update(value=best_score, nodes=board.nos, completo=not cortado[0],
+                    pv=variacao(converte_move(best_action)) if best_action is not None else [])
+    if stats is not None:
+        stats.finish(value=best_score)
     return best_action
 
 
@@ -78,70 +277,391 @@ def random_player(game, state):
     """A player that chooses a legal move at random."""
     return random.choice(game.actions(state))
 
-def expectiminimax(game,state):
+def expectiminimax(game, state, tabela=None, depth=None, deadline=None, pv=None, info=None, stats=None):
     """Return the best move for a player after dice are thrown. The game tree
-	includes chance nodes along with min and max nodes. [Figure 5.11]"""
+	includes chance nodes along with min and max nodes. [Figure 5.11]
+	The tree is walked with apply/undo on a single Board, and max/min node
+	values are shared across transpositions through the transposition table.
+	depth, deadline, pv, info and stats work as in alphabeta_search; the
+	node count also includes the leaves evaluated in place, without
+	applying a move, so it stays comparable with alphabeta_search's."""
     player = game.to_move(state)
-    d = 0
+    d = profundidade(state) if depth is None else depth
     n = len(state.pedras)
-    if n == 7:
-        d = 7
-    elif n <= 6:
-        d = 9
     if state.utility !=0 or n == 0 or len(state.pedras_restantes) <= 3:
         return None
-    def max_value(state, depth):
-        #print("Profundidade: ", depth)
+    board = Board(converte_estado(state), player)
+    if tabela is None:
+        tabela = TranspositionTable()
+    tabela.nova_busca()
+    cortado = [False]
+    folhas = [0]
+    avaliar = avalia
+    if stats is not None:
+        stats.start('expectiminimax', d)
+        stats.instrumenta(board)
+        avaliar = stats.cronometra('eval', avalia)
+
+    proximo = [256]
+
+    def relogio():
+        if deadline is not None and board.nos >= proximo[0]:
+            proximo[0] = board.nos + 256
+            if time.time() > deadline:
+                raise SearchTimeout
+
+    def max_value(chance, depth):
         v = -infinity
         if depth >= d:
-            return game.eval(state, player)
-        #for i in state.moves:
-        #    print("(", i[0], ", ponta=", i[1], ")")
-
-        for acao in game.actions(state):
-            v = max(v, chance_node(state, acao, depth))
+            cortado[0] = True
+            folhas[0] += 1
+            if stats is not None:
+                stats.evals += 1
+            return avaliar(board, player)
+        relogio()
+        if stats is not None:
+            stats.node(depth)
+        chave = board.chave ^ ZOBRIST_CHANCE[chance[0]]
+        entrada = tabela.probe(chave)
+        if entrada is not None and entrada[2] >= d - depth:
+            return entrada[1]
+        melhor = None
+        for acao in hash_move_first(list(chance[1]), entrada):
+            u = chance_node(acao, depth)
+            if u > v:
+                v, melhor = u, acao
+        tabela.store(chave, v, d - depth, EXATO, melhor)
         return v
 
-    def min_value(state, depth):
+    def min_value(chance, depth):
         if depth >= d:
-            return game.eval(state, player)
+            cortado[0] = True
+            folhas[0] += 1
+            if stats is not None:
+                stats.evals += 1
+            return avaliar(board, player)
+        relogio()
+        if stats is not None:
+            stats.node(depth)
+        chave = board.chave ^ ZOBRIST_CHANCE[chance[0]]
+        entrada = tabela.probe(chave)
+        if entrada is not None and entrada[2] >= d - depth:
+            return entrada[1]
         v = infinity
-        for acao in game.actions(state):
-            v = min(v, chance_node(state, acao, depth))
+        melhor = None
+        for acao in hash_move_first(list(chance[1]), entrada):
+            u = chance_node(acao, depth)
+            if u < v:
+                v, melhor = u, acao
+        tabela.store(chave, v, d - depth, EXATO, melhor)
         return v
 
-    def chance_node(state, action, depth):
-        res_state = game.result(state, action, player)
-        if game.terminal_test(res_state):
-            return game.utility(res_state, player)
+    def chance_node(action, depth):
+        board.apply(action)
+        relogio()
+        if stats is not None:
+            stats.node(depth)
+        if board.utility != 0:
+            if stats is not None:
+                stats.terminals += 1
+            sum_chances = board.utility
+        elif depth >= d:
+            cortado[0] = True
+            if stats is not None:
+                stats.evals += 1
+            sum_chances = avaliar(board, player)
+        else:
+            sum_chances = 0
+            chances = board.chances(board.moves())
+            if stats is not None:
+                stats.chance(len(chances))
+            for chance in chances:
+                if board.to_move == player:
+                    util = max_value(chance, depth+1)
+                else:
+                    util = min_value(chance, depth+1)
+                sum_chances += util * probabilidade(chance)
+            sum_chances /= len(chances)
+        board.undo()
+        return sum_chances
+
+    # Body of expectiminimax:
+    best_score = -infinity
+    best_action = None
+    for a in ordena_raiz(game.actions(state), pv):
+        v = chance_node(converte_move(a), 1)
+        if v > best_score:
+            best_score = v
+            best_action = a
+    if info is not None:
+        info.update(value=best_score, nodes=board.nos + folhas[0], completo=not cortado[0],
+                    pv=[converte_move(best_action)] if best_action is not None else [])
+    if stats is not None:
+        stats.finish(value=best_score)
+    return best_action
+
+
+def star_expectiminimax(game, state, tabela=None, depth=None, deadline=None, pv=None, info=None, probing=False,
+                        stats=None):
+    """expectiminimax with bounds: chooses the same move with fewer nodes.
+    Utilities lie in -1..4 and limites_eval bounds the eval of whatever a
+    chance node can still reach, so max/min nodes search alpha-beta windows
+    and a chance node stops expanding outcomes as soon as the ones left
+    cannot bring its value back inside its window (Star1).  With probing
+    (Star2), each outcome is first bounded by searching its first move
+    alone; in Domino this rarely pays for itself, so it is off by default.
+    Chance node values are memoized for the whole search.  Other arguments,
+    stats included, as in expectiminimax."""
+    player = game.to_move(state)
+    d = profundidade(state) if depth is None else depth
+    n = len(state.pedras)
+    if state.utility !=0 or n == 0 or len(state.pedras_restantes) <= 3:
+        return None
+    board = Board(converte_estado(state), player)
+    if tabela is None:
+        tabela = TranspositionTable()
+    tabela.nova_busca()
+    memo = {}
+    faixas = {}
+    cortado = [False]
+    folhas = [0]
+    avaliar = avalia
+    if stats is not None:
+        stats.start('star_expectiminimax', d)
+        stats.instrumenta(board)
+        avaliar = stats.cronometra('eval', avalia)
+    proximo = [256]
+
+    def relogio():
+        if deadline is not None and board.nos >= proximo[0]:
+            proximo[0] = board.nos + 256
+            if time.time() > deadline:
+                raise SearchTimeout
+
+    def node_value(chance, depth, alpha, beta):
         if depth >= d:
-            return game.eval(state, player)
+            cortado[0] = True
+            folhas[0] += 1
+            if stats is not None:
+                stats.evals += 1
+            return avaliar(board, player)
+        relogio()
+        if stats is not None:
+            stats.node(depth)
+        maximiza = board.to_move == player
+        chave = board.chave ^ ZOBRIST_CHANCE[chance[0]]
+        alpha0, beta0 = alpha, beta
+        entrada = tabela.probe(chave)
+        if entrada is not None and entrada[2] >= d - depth:
+            if entrada[3] == EXATO:
+                return entrada[1]
+            if entrada[3] == INFERIOR:
+                alpha = max(alpha, entrada[1])
+            else:
+                beta = min(beta, entrada[1])
+            if alpha >= beta:
+                return entrada[1]
+        v = -infinity if maximiza else infinity
+        melhor = None
+        for acao in hash_move_first(list(chance[1]), entrada):
+            u = chance_node(acao, depth, alpha, beta)
+            if maximiza:
+                if u > v:
+                    v, melhor = u, acao
+                if v >= beta:
+                    if stats is not None:
+                        stats.cutoff(depth)
+                    break
+                alpha = max(alpha, v)
+            else:
+                if u < v:
+                    v, melhor = u, acao
+                if v <= alpha:
+                    if stats is not None:
+                        stats.cutoff(depth)
+                    break
+                beta = min(beta, v)
+        if v <= alpha0:
+            tabela.store(chave, v, d - depth, SUPERIOR, melhor)
+        elif v >= beta0:
+            tabela.store(chave, v, d - depth, INFERIOR, melhor)
+        else:
+            tabela.store(chave, v, d - depth, EXATO, melhor)
+        return v
+
+    def limites(depth):
+        # Values below this chance node come from at most d - depth more
+        # moves, so only that many tiles can still leave each side.
+        restante = d - depth
+        chave = (board.pedras, board.pedras_restantes, board.to_move, restante)
+        if chave not in faixas:
+            proprias = sum(1 for i in range(restante) if (board.to_move + i) % 4 == player)
+            baixo, alto = limites_eval(board, player, proprias, restante - proprias)
+            faixas[chave] = (min(-1, baixo), max(4, alto))
+        return faixas[chave]
+
+    def star(depth, alpha, beta):
+        chances = board.chances(board.moves())
+        k = len(chances)
+        probs = [probabilidade(chance) for chance in chances]
+        if stats is not None:
+            stats.chance(k)
+        if depth + 1 >= d:
+            cortado[0] = True
+            folhas[0] += 1
+            if stats is not None:
+                stats.evals += 1
+            return avaliar(board, player) * sum(probs) / k
+        if k == 1:
+            p = probs[0]
+            return node_value(chances[0], depth + 1, alpha / p, beta / p) * p if p > 0 else 0
+        L, U = limites(depth)
+        lo = [L] * k
+        hi = [U] * k
+        if probing and k > 1 and depth + 1 < d:
+            # Star2: the first move bounds a max outcome from below and a
+            # min outcome from above.
+            maximiza = board.to_move == player
+            for i, chance in enumerate(chances):
+                if probs[i] <= 0:
+                    continue
+                if maximiza:
+                    resto = sum(probs[j] * lo[j] for j in range(k) if j != i)
+                    b = (beta * k - resto) / probs[i]
+                    if b > L:
+                        lo[i] = chance_node(chance[1][0], depth + 1, L, b)
+                    total = resto + probs[i] * lo[i]
+                    if total >= beta * k:
+                        return max(total / k, beta)
+                else:
+                    resto = sum(probs[j] * hi[j] for j in range(k) if j != i)
+                    a = (alpha * k - resto) / probs[i]
+                    if a < U:
+                        hi[i] = chance_node(chance[1][0], depth + 1, a, U)
+                    total = resto + probs[i] * hi[i]
+                    if total <= alpha * k:
+                        return min(total / k, alpha)
+        # Star1
+        resto_lo = sum(p * x for p, x in zip(probs, lo) if p > 0)
+        resto_hi = sum(p * x for p, x in zip(probs, hi) if p > 0)
         sum_chances = 0
-        chances = game.chances(res_state)
-        num_chances = len(chances)
-        for chance in chances:
-            res_state = game.outcome(res_state, chance)
-            util = 0
-            if res_state.to_move == player:
-                util = max_value(res_state, depth+1)
+        for i, chance in enumerate(chances):
+            p = probs[i]
+            if p <= 0:
+                continue
+            resto_lo -= p * lo[i]
+            resto_hi -= p * hi[i]
+            a = (alpha * k - sum_chances - resto_hi) / p
+            b = (beta * k - sum_chances - resto_lo) / p
+            util = node_value(chance, depth + 1, a, b)
+            if util <= a:
+                if stats is not None:
+                    stats.cutoff(depth)
+                return min((sum_chances + util * p + resto_hi) / k, alpha)
+            if util >= b:
+                if stats is not None:
+                    stats.cutoff(depth)
+                return max((sum_chances + util * p + resto_lo) / k, beta)
+            sum_chances += util * p
+        return sum_chances / k
+
+    def chance_node(action, depth, alpha, beta):
+        board.apply(action)
+        relogio()
+        if stats is not None:
+            stats.node(depth)
+        if board.utility != 0:
+            if stats is not None:
+                stats.terminals += 1
+            v = board.utility
+        elif depth >= d:
+            cortado[0] = True
+            if stats is not None:
+                stats.evals += 1
+            v = avaliar(board, player)
+        else:
+            chave = (board.chave, d - depth)
+            m = memo.get(chave)
+            if m is not None and (m[1] == EXATO or (m[1] == INFERIOR and m[0] >= beta) or
+                                  (m[1] == SUPERIOR and m[0] <= alpha)):
+                v = m[0]
             else:
-                util = min_value(res_state, depth+1)
-            sum_chances += util * game.probability(chance)
-        return sum_chances / num_chances
+                v = star(depth, alpha, beta)
+                tipo = SUPERIOR if v <= alpha else INFERIOR if v >= beta else EXATO
+                if m is None or m[1] != EXATO:
+                    memo[chave] = (v, tipo)
+        board.undo()
+        return v
+
+    # Body of star_expectiminimax:
+    best_score = -infinity
+    best_action = None
+    for a in ordena_raiz(game.actions(state), pv):
+        v = chance_node(converte_move(a), 1, best_score, infinity)
+        if v > best_score:
+            best_score = v
+            best_action = a
+    if info is not None:
+        info.update(value=best_score, nodes=board.nos + folhas[0], completo=not cortado[0],
+                    pv=[converte_move(best_action)] if best_action is not None else [])
+    if stats is not None:
+        stats.finish(value=best_score)
+    return best_action
 
-    # Body of expectiminimax:
-    """k = -infinity
-    action = None
-    for a in game.actions(state):
-        print(a[0])
-        c = chance_node(state, a, 1)
-        print(c)
-        k = max(k,c)
-        action = a
-    print("k: ", k)
-    return action"""
-    return argmax(game.actions(state),
-                  key=lambda a: chance_node(state, a, 1), default=None)
+
+def star_player(game, state):
+    """star_expectiminimax as a (game, state) player."""
+    return star_expectiminimax(game, state)
+
+
+def iterative_deepening(game, state, search=alphabeta_search, budget=0.05, max_depth=28, info=None, ordering=None,
+                        stats=None):
+    """Run search one ply deeper at a time until budget seconds have passed,
+    and return the best move of the last iteration that completed.  Each
+    iteration shares the transposition table of the previous ones and tries
+    their principal variation first.  info, if given, receives the depth
+    reached along with the last iteration's value, pv and node count.
+    ordering is handed to searches that take one, like alphabeta_search,
+    and stats to every iteration."""
+    deadline = time.time() + budget
+    extra = {} if ordering is None else {'ordering': ordering}
+    if stats is not None:
+        extra['stats'] = stats
+    tabela = TranspositionTable()
+    best_action = None
+    resultado = {'depth': 0, 'pv': [], 'nodes': 0}
+    for depth in range(1, max_depth + 1):
+        iteracao = {}
+        try:
+            action = search(state=state, game=game, tabela=tabela, depth=depth, deadline=deadline,
+                            pv=resultado['pv'], info=iteracao, **extra)
+        except SearchTimeout:
+            break
+        if action is None:
+            return None
+        best_action = action
+        resultado.update(iteracao, depth=depth, nodes=resultado['nodes'] + iteracao['nodes'])
+        if iteracao['completo']:
+            break
+    if info is not None:
+        info.update(resultado)
+    if best_action is None:
+        best_action = game.actions(state)[0]
+    return best_action
+
+
+def iterative_player(search=alphabeta_search, budget=0.05, ordering=None):
+    """A player that runs iterative_deepening with budget seconds per move."""
+    def player(game, state):
+        return iterative_deepening(game, state, search, budget, ordering=ordering)
+    return player
+
+
+def ordered_player(game, state, ordering=None):
+    """alphabeta_search with move ordering.  Bind one MoveOrdering per game,
+    e.g. functools.partial(ordered_player, ordering=MoveOrdering()), so the
+    history table carries over from move to move."""
+    return alphabeta_search(state, game, ordering=MoveOrdering() if ordering is None else ordering)
 
 class Pedra:
 
@@ -200,6 +720,7 @@ class Domino(StochasticGame):
             pedras_restantes += self.jogadores[i]
         self.initial = GameState(to_move=0, pedras=self.jogadores[0].copy(), pedras_restantes=pedras_restantes, ponta1=None,ponta2=None,
                                  moves=self.moves(0,self.jogadores[0], pedras_restantes, None, None, 0), utility=0)
+        self.historico = []
     def reset(self):
         self.__init__()
     def cria_domino(self):
@@ -270,10 +791,9 @@ class Domino(StochasticGame):
         buchas = self.buchas(state.pedras)
         n_pedras = n
         delta = m - n
-        movimentos = self.moves(player, state.pedras, state.pedras_restantes, state.ponta1, state.ponta2, player)
         soma_pedras = self.soma_pedras_max(state)
         diversidade = self.checa_diversidade_max(state)
-        mov = len(movimentos)
+        mov = self.mobilidade(state.pedras, state.ponta1, state.ponta2)
         if player <= 1:
             return -0.9 * buchas - 0.2 * n_pedras + 0.7 * delta + 0.5 * mov - 0.4*soma_pedras + 0.6*diversidade
         if player == 2:
@@ -282,55 +802,43 @@ class Domino(StochasticGame):
             return 0.5*mov + 0.6*diversidade
 
     def moves(self,to_move,pedras, pedras_restantes, ponta1, ponta2, player):
-        moves = []
-        i = 0
-        if to_move == player:
-
-            for pedra in pedras:
-                if ponta1 is not None:
-                    if pedra.igual(ponta1):
-                        i += 1
-                        moves.append((pedra, 0))
-                    elif pedra.igual(ponta2):
-                        i += 1
-                        moves.append((pedra, 1))
-                else:
-                    moves.append((pedra, -1))
+        """Every tile on an empty table; otherwise the tiles holding each
+        open pip, on that end (once if both ends show the same pip); or a
+        pass."""
+        mao = pedras if to_move == player else pedras_restantes
+        if ponta1 is None:
+            moves = [(pedra, -1) for pedra in mao]
         else:
-            for pedra in pedras_restantes:
-                if ponta1 is not None:
-                    if pedra.igual(ponta1):
-                        i += 1
-                        moves.append((pedra, 0))
-                    elif pedra.igual(ponta2):
-                        i += 1
-                        moves.append((pedra, 1))
-                else:
-                    moves.append((pedra, -1))
-
-        if i == 0:
+            p1, p2 = pontas_abertas(ponta1, ponta2)
+            moves = [(pedra, 0) for pedra in mao if p1 in pedra.valor]
+            if p2 != p1:
+                moves += [(pedra, 1) for pedra in mao if p2 in pedra.valor]
+        if not moves:
             moves.append((Pedra(-1, -1, -1), -1))
         return moves
 
+    def mobilidade(self, pedras, ponta1, ponta2):
+        """Number of tiles that can be played, at least 1 (a pass)."""
+        if ponta1 is None:
+            return max(len(pedras), 1)
+        p1, p2 = pontas_abertas(ponta1, ponta2)
+        return max(sum(1 for pedra in pedras if p1 in pedra.valor or p2 in pedra.valor), 1)
+
     def compute_utility(self, to_move, pedras, pedras_restantes, ponta1, ponta2, move, player):
 
         if move[0].valor[0] == -1 and ponta1 is not None:
-            if to_move == player:
-                for p in pedras_restantes:
-                    if p.igual(ponta1) or p.igual(ponta2):
-                        return 0
-            else:
-                for p in pedras:
-                    if p.igual(ponta1) or p.igual(ponta2):
-                        return 0
+            p1, p2 = pontas_abertas(ponta1, ponta2)
+            for p in (pedras_restantes if to_move == player else pedras):
+                if p1 in p.valor or p2 in p.valor:
+                    return 0
             total = len(pedras)
             soma = 0
             for pedra in pedras:
                 soma += pedra.getValor()
-            pedras_restantes.sort(key=lambda x: (x.valor[0] + x.valor[1]))
+            restantes = sorted(pedras_restantes, key=lambda x: (x.valor[0] + x.valor[1]))
             soma_res = 0
-            for i in range(min([total, len(pedras_restantes)])):
-                soma_res += pedras_restantes[i].getValor()
+            for i in range(min([total, len(restantes)])):
+                soma_res += restantes[i].getValor()
             if soma < soma_res:
                 if to_move != 0:
                     return -1
@@ -378,8 +886,9 @@ class Domino(StochasticGame):
 
     def pode_jogar(self, i, state):
         if state.ponta1 is not None:
+            p1, p2 = pontas_abertas(state.ponta1, state.ponta2)
             for pedra in self.jogadores[i]:
-                if pedra.igual(state.ponta1) or pedra.igual(state.ponta2):
+                if p1 in pedra.valor or p2 in pedra.valor:
                     return True
             return False
         else:
@@ -406,28 +915,13 @@ class Domino(StochasticGame):
         utility = self.compute_utility(state.to_move, state.pedras, state.pedras_restantes, state.ponta1,state.ponta2, move, player)
 
         if move[0].valor[0] != -1:
-            if state.ponta1 is not None:
-                if move[1] == 0:
-                    if move[0].valor[0] == state.ponta1.valor[0] or move[0].valor[0] == state.ponta1.valor[1]:
-                        move[0].position = 1
-                        if state.ponta1.position == -1:
-                            state.ponta1.position = 1
-                    elif move[0].valor[1] == state.ponta1.valor[0] or move[0].valor[1] == state.ponta1.valor[1]:
-                        move[0].position = 0
-                        if state.ponta1.position == -1:
-                            state.ponta1.position = 1
-                    ponta1 = move[0]
-                elif move[1] == 1:
-                    if move[0].valor[0] == state.ponta2.valor[0] or move[0].valor[0] == state.ponta2.valor[1]:
-                        move[0].position = 1
-                    elif move[0].valor[1] == state.ponta2.valor[0] or move[0].valor[1] == state.ponta2.valor[1]:
-                        move[0].position = 0
-                    ponta2 = move[0]
-
-            else:
-                move[0].position = -1
-                ponta1 = move[0]
-                ponta2 = move[0]
+            if state.ponta1 is None:
+                ponta1 = Pedra(move[0].valor[0], move[0].valor[1], 0)
+                ponta2 = Pedra(move[0].valor[0], move[0].valor[1], 1)
+            elif move[1] == 0:
+                ponta1 = self.encaixa(move[0], pontas_abertas(state.ponta1, state.ponta2)[0])
+            elif move[1] == 1:
+                ponta2 = self.encaixa(move[0], pontas_abertas(state.ponta1, state.ponta2)[1])
             if state.to_move == player:
                 pedras.remove(move[0])
             else:
@@ -435,9 +929,21 @@ class Domino(StochasticGame):
 
         to_move = (state.to_move + 1) % 4
         new_state = GameState(to_move=to_move, pedras=pedras, pedras_restantes=pedras_restantes, ponta1=ponta1,
-                              ponta2=ponta2, moves=self.moves(to_move, pedras, pedras_restantes, ponta1, ponta2, player), utility=utility)
+                              ponta2=ponta2, moves=partial(self.moves, to_move, pedras, pedras_restantes, ponta1, ponta2, player),
+                              utility=utility)
         return new_state
 
+    def encaixa(self, pedra, aberta):
+        """New end left by placing pedra on an end showing pip aberta.  Tiles
+        are never mutated: the end is a fresh Pedra whose position is the
+        half left open."""
+        return Pedra(pedra.valor[0], pedra.valor[1], 1 if pedra.valor[0] == aberta else 0)
+
+    def registra(self, state, move):
+        """Record in historico that state.to_move played move on the ends
+        of state, so players can tell hand sizes and missing pips."""
+        self.historico.append((state.to_move, move, state.ponta1, state.ponta2))
+
     def ponta1(self, move):
         return move[1] == 0
 
@@ -445,28 +951,31 @@ class Domino(StochasticGame):
         return move[1] == 1
 
 
-    def chances(self, state):
-        n_moves = len(state.moves)
+    def chances(self, state, player=0):
+        """An opponent of player plays on ponta1, on ponta2 or passes, as
+        in bitdomino.separa_chances: chance[2] counts the pool tiles behind
+        each chance, a tile that fits both ends counting half on each.
+        player is the seat whose hand is state.pedras, as in result."""
         lista = []
-        if state.to_move != 0:
+        if state.to_move != player:
             n = len(state.pedras_restantes)
-
-            p1 = (1, list(filter(self.ponta1, state.moves)), n_moves, n)
-            if len(p1[1]) > 0:
-                lista.append(p1)
-            p2 = (2, list(filter(self.ponta2, state.moves)), n_moves, n)
-            if len(p2[1]) > 0:
-                lista.append(p2)
-            pi = (-1, [(Pedra(-1, -1, -1), -1)], n_moves, n)
+            moves1 = list(filter(self.ponta1, state.moves))
+            moves2 = list(filter(self.ponta2, state.moves))
+            ambas = len({m[0].tupla() for m in moves1} & {m[0].tupla() for m in moves2})
+            if len(moves1) > 0:
+                lista.append((1, moves1, len(moves1) - ambas / 2, n))
+            if len(moves2) > 0:
+                lista.append((2, moves2, len(moves2) - ambas / 2, n))
+            pi = (-1, [(Pedra(-1, -1, -1), -1)], len(moves1) + len(moves2) - ambas, n)
             lista.append(pi)
 
             return lista
         else:
-            return [(0, state.moves, n_moves, len(state.pedras))]
+            return [(0, state.moves, len(state.moves), len(state.pedras))]
 
     def probability(self, chance):
         if chance[0] == 1 or chance[0] == 2:
-            return len(chance[1])/chance[3]
+            return chance[2]/chance[3]
         elif chance[0] == -1:
             return 1 - (chance[2]/chance[3])
         else:
@@ -484,31 +993,44 @@ class Domino(StochasticGame):
         return GameState(to_move=state.to_move, pedras=state.pedras, pedras_restantes=state.pedras_restantes, ponta1=state.ponta1,
                          ponta2=state.ponta2, moves=chance[1], utility=state.utility)
 
+    def avanca(self, state, move, recalcula=True):
+        """Play move for the seat to move in the real game: record it, take
+        the tile from its hand and return the winner (-1 while the game
+        goes on) with the GameState of the next seat to move.  With
+        recalcula, as in play_game, that state's utility is compute_utility
+        for the seat about to move; otherwise it is the utility result gave
+        the seat that moved, as play_game_mdp and the learning agents use."""
+        self.registra(state, move)
+        if move[0].valor[0] != -1:
+            self.jogadores[state.to_move].remove(move[0])
+        state_res = self.result(state, move, state.to_move)
+        vencedor = self.vitoria(state_res)
+        to_move = state_res.to_move
+        pedras = self.jogadores[to_move].copy()
+        pedras_restantes = [p for i in range(4) if i != to_move for p in self.jogadores[i]]
+        utility = state_res.utility
+        if recalcula:
+            utility = self.compute_utility(to_move, pedras, pedras_restantes, state_res.ponta1, state_res.ponta2,
+                                           move, to_move)
+        proximo = GameState(to_move=to_move, pedras=pedras, pedras_restantes=pedras_restantes,
+                            ponta1=state_res.ponta1, ponta2=state_res.ponta2,
+                            moves=partial(self.moves, to_move, pedras, pedras_restantes, state_res.ponta1,
+                                          state_res.ponta2, to_move),
+                            utility=utility)
+        return vencedor, proximo
+
     def play_game(self, *players):
         """Play an n-person, move-alternating game."""
         state = self.initial
         while True:
             for player in players:
                 move = player(self, state)
-                if move[0].valor[0] != -1:
-                    self.jogadores[state.to_move].remove(move[0])
-                state_res = self.result(state, move, state.to_move)
-                vencedor = self.vitoria(state_res)
+                vencedor, state = self.avanca(state, move)
 
                 if vencedor != -1:
                     self.imprime_jogadores()
                     print("Vencedor: ",vencedor)
                     return vencedor
-                ponta1 = state_res.ponta1
-                ponta2 = state_res.ponta2
-                to_move = state_res.to_move
-                pedras_restantes = []
-                for i in range(4):
-                    if i != to_move:
-                        pedras_restantes += self.jogadores[i]
-                state = GameState(to_move=to_move, pedras=self.jogadores[to_move].copy(), pedras_restantes=pedras_restantes, ponta1=ponta1, ponta2=ponta2,
-                                  moves=self.moves(to_move, self.jogadores[to_move], pedras_restantes, ponta1, ponta2, to_move),
-                                  utility=self.compute_utility(to_move, self.jogadores[to_move], pedras_restantes, ponta1, ponta2, move,to_move))
 
 
 """
@@ -0,0 +1,113 @@
+"""Vectorized Domino.eval for batches of positions.
+
+A batch is four NumPy arrays of the same length: the hand and the pool as
+28-bit masks (the bitdomino tile index) and the two open pips, with -1 for
+an empty table.  features returns one column per term of Domino.eval and
+batch_eval the weighted score, both in a single pass over the batch."""
+import numpy as np
+from bitdomino import PEDRAS, NAIPE, VALOR, PESOS, converte_estado, converte_move
+
+FEATURES = ('buchas', 'n_pedras', 'delta', 'mov', 'soma', 'diversidade')
+# Columns of move_features: the FEATURES of the position a move leaves,
+# then terms of the move itself.
+MOVE_FEATURES = FEATURES + ('passa', 'valor', 'bucha', 'bias')
+# Size of each FEATURES term, to keep move_features near [-1, 1].
+ESCALA = np.array([21.0, 7.0, 7.0, 7.0, 84.0, 7.0])
+
+# Rows are the eval weights of players 0 to 3, columns follow FEATURES.
+WEIGHTS = np.array(PESOS)
+
+_BITS = np.arange(len(PEDRAS), dtype=np.int64)
+_A = np.array([a for (a, b) in PEDRAS], dtype=np.int64)
+_B = np.array([b for (a, b) in PEDRAS], dtype=np.int64)
+_VALOR = np.array(VALOR, dtype=np.float64)
+_PESO_BUCHA = np.array([(a or 1) if a == b else 0 for (a, b) in PEDRAS], dtype=np.float64)
+_TEM_NAIPE = np.array([[a == p or b == p for p in range(7)] for (a, b) in PEDRAS], dtype=np.float64)
+# NAIPE_ARRAY[7] is the empty mask, used for pip -1.
+NAIPE_ARRAY = np.array(NAIPE + [0], dtype=np.int64)
+
+
+def expande(mascaras):
+    """(N, 28) 0/1 matrix of the tiles in each mask."""
+    return ((np.asarray(mascaras, dtype=np.int64)[:, None] >> _BITS) & 1).astype(np.float64)
+
+
+def empacota(states):
+    """Batch arrays of a list of GameState, BitGameState or Board objects."""
+    n = len(states)
+    pedras = np.empty(n, dtype=np.int64)
+    pedras_restantes = np.empty(n, dtype=np.int64)
+    ponta1 = np.empty(n, dtype=np.int64)
+    ponta2 = np.empty(n, dtype=np.int64)
+    for i, state in enumerate(states):
+        if isinstance(state.pedras, list):
+            state = converte_estado(state)
+        pedras[i] = state.pedras
+        pedras_restantes[i] = state.pedras_restantes
+        ponta1[i] = -1 if state.ponta1 is None else state.ponta1
+        ponta2[i] = -1 if state.ponta2 is None else state.ponta2
+    return pedras, pedras_restantes, ponta1, ponta2
+
+
+def sucessores(state):
+    """Batch arrays of the positions left to the mover by each move of a
+    GameState (its hand without the tile, the same pool, the new ends),
+    with the tile index of each move (-1 for a pass)."""
+    bits = converte_estado(state)
+    movidas = np.array([converte_move(m) for m in state.moves], dtype=np.int64).reshape(-1, 2)
+    tile, lado = movidas[:, 0], movidas[:, 1]
+    joga_pedra = tile >= 0
+    t = np.maximum(tile, 0)
+    a, b = _A[t], _B[t]
+    ponta1 = -1 if bits.ponta1 is None else bits.ponta1
+    ponta2 = -1 if bits.ponta2 is None else bits.ponta2
+    if ponta1 < 0:
+        novo1, novo2 = a, b
+    else:
+        novo1 = np.where(lado == 0, np.where(a == ponta1, b, a), ponta1)
+        novo2 = np.where(lado == 1, np.where(a == ponta2, b, a), ponta2)
+    n = len(tile)
+    return (np.where(joga_pedra, bits.pedras & ~(np.int64(1) << t), bits.pedras),
+            np.full(n, bits.pedras_restantes, dtype=np.int64),
+            np.where(joga_pedra, novo1, ponta1), np.where(joga_pedra, novo2, ponta2), tile)
+
+
+def features(pedras, pedras_restantes, ponta1, ponta2):
+    """(N, 6) matrix of the Domino.eval terms, columns as in FEATURES."""
+    mao = expande(pedras)
+    n = mao.sum(axis=1)
+    m = expande(pedras_restantes).sum(axis=1) / 3
+    naipes = mao @ _TEM_NAIPE
+    ponta1 = np.asarray(ponta1)
+    ponta2 = np.asarray(ponta2)
+    alvo = NAIPE_ARRAY[ponta1] | NAIPE_ARRAY[ponta2]
+    mov = np.where(ponta1 < 0, n, expande(np.asarray(pedras, dtype=np.int64) & alvo).sum(axis=1))
+    return np.column_stack([mao @ _PESO_BUCHA, n, m - n, np.maximum(mov, 1),
+                            mao @ _VALOR, (naipes > 0).sum(axis=1)])
+
+
+def move_features(state):
+    """(moves, len(MOVE_FEATURES)) matrix of the moves of a GameState: the
+    scaled eval terms of the position each leaves to the mover, whether it
+    is a pass, the tile's pip sum over 12, whether it is a double and a
+    constant 1."""
+    pedras, pedras_restantes, ponta1, ponta2, tile = sucessores(state)
+    passa = tile < 0
+    t = np.maximum(tile, 0)
+    return np.column_stack([features(pedras, pedras_restantes, ponta1, ponta2) / ESCALA, passa,
+                            np.where(passa, 0.0, _VALOR[t] / 12), np.where(passa, 0.0, _A[t] == _B[t]),
+                            np.ones(len(tile))])
+
+
+def batch_eval(pedras, pedras_restantes, ponta1, ponta2, player):
+    """Domino.eval of every position in the batch.  player is an int or an
+    array with one player per position."""
+    x = features(pedras, pedras_restantes, ponta1, ponta2)
+    if np.ndim(player) == 0:
+        return x @ WEIGHTS[player]
+    return np.einsum('ij,ij->i', x, WEIGHTS[np.asarray(player)])
+
+
+def eval_states(states, player):
+    """batch_eval of a list of states."""
+    return batch_eval(*empacota(states), player)
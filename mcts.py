@@ -0,0 +1,169 @@
+"""Information-set Monte Carlo Tree Search.
+
+One tree is grown over the moves of all four seats.  Every iteration deals
+the unseen tiles afresh with pimc.amostra, walks down the tree through the
+moves that are legal in that deal (UCT, with the number of times a move
+was available standing in for the parent's visits), adds one node and
+plays the deal out with a rollout policy.  Each node counts the wins of the
+seat that made its move.  Root-parallel search grows independent trees in
+worker processes and adds up their root statistics."""
+import math
+import random
+import time
+from multiprocessing import Pool
+from bitdomino import BitGameState, avalia, gera_moves, joga
+from pimc import amostra, percepcao, restricoes, vencedor
+
+
+class No:
+    """Tree node reached by a move of jogador."""
+
+    __slots__ = ('jogador', 'filhos', 'visitas', 'vitorias', 'disponivel')
+
+    def __init__(self, jogador):
+        self.jogador = jogador
+        self.filhos = {}
+        self.visitas = 0
+        self.vitorias = 0
+        self.disponivel = 1
+
+
+def random_rollout(rng, maos, ponta1, ponta2, vez, moves):
+    """Uniformly random legal move."""
+    return rng.choice(moves)
+
+
+def greedy_rollout(rng, maos, ponta1, ponta2, vez, moves):
+    """Move whose resulting position has the best Domino.eval for the
+    mover, who is given the hand it holds in the deal."""
+    if len(moves) == 1:
+        return moves[0]
+    outras = 0
+    for i in range(4):
+        if i != vez:
+            outras |= maos[i]
+    melhor, valor = moves[0], -float('inf')
+    for move in moves:
+        p1, p2 = joga(move[0], ponta1, ponta2, move[1])
+        v = avalia(BitGameState(to_move=vez, pedras=maos[vez] & ~(1 << move[0]), pedras_restantes=outras,
+                                mesa=0, ponta1=p1, ponta2=p2, moves=None, utility=0), vez)
+        if v > valor:
+            melhor, valor = move, v
+    return melhor
+
+
+ROLLOUTS = {'random': random_rollout, 'greedy': greedy_rollout}
+
+
+def ismcts(mao, livres, tamanhos, faltam, ponta1, ponta2, player, iterations=1000, budget=None,
+           rollout='random', c=0.7, seed=None):
+    """Grow an information-set tree for player, who holds mao, for the
+    given iterations or until budget seconds have passed, and return
+    the (visits, wins) of each root move and the iterations done."""
+    rng = random.Random(seed)
+    politica = ROLLOUTS[rollout]
+    deadline = None if budget is None else time.time() + budget
+    raiz = No(None)
+    n = 0
+    while n < iterations and (deadline is None or time.time() < deadline):
+        n += 1
+        maos = amostra(rng, livres, tamanhos, faltam)
+        maos[player] = mao
+        p1, p2, vez = ponta1, ponta2, player
+        no = raiz
+        caminho = []
+        ganhador = -1
+        expandido = False
+        while ganhador == -1:
+            moves = gera_moves(maos[vez], p1, p2)
+            if expandido:
+                move = politica(rng, maos, p1, p2, vez, moves)
+            else:
+                novos = [m for m in moves if m not in no.filhos]
+                for m in moves:
+                    if m in no.filhos:
+                        no.filhos[m].disponivel += 1
+                if novos:
+                    move = rng.choice(novos)
+                    no.filhos[move] = No(vez)
+                    expandido = True
+                else:
+                    filhos = no.filhos
+                    move = max(moves, key=lambda m: filhos[m].vitorias / filhos[m].visitas +
+                               c * math.sqrt(math.log(filhos[m].disponivel) / filhos[m].visitas))
+                no = no.filhos[move]
+                caminho.append(no)
+            if move[0] != -1:
+                maos[vez] &= ~(1 << move[0])
+                p1, p2 = joga(move[0], p1, p2, move[1])
+            ganhador = vencedor(maos, p1, p2)
+            vez = (vez + 1) % 4
+        for no in caminho:
+            no.visitas += 1
+            no.vitorias += ganhador == no.jogador
+    return {move: (filho.visitas, filho.vitorias) for move, filho in raiz.filhos.items()}, n
+
+
+def _ismcts(args):
+    return ismcts(*args)
+
+
+class ISMCTSPlayer:
+    """(game, state) player running information-set MCTS.
+
+    Each call runs up to iterations iterations, stopping early once budget
+    seconds have passed, with the 'random' or 'greedy' rollout policy and
+    exploration constant c.  With processes > 1 every worker grows its own
+    tree with the full budget and the most visited move over all trees is
+    played; call close() when done.  iterations_per_sec is the rate of the
+    last call and raiz its merged root statistics."""
+
+    def __init__(self, iterations=1000, budget=None, rollout='random', c=0.7, processes=1, seed=None):
+        self.iterations = iterations
+        self.budget = budget
+        self.rollout = rollout
+        self.c = c
+        self.processes = processes
+        self.rng = random.Random(seed)
+        self.pool = None
+        self.iterations_per_sec = 0.0
+        self.raiz = {}
+
+    def __call__(self, game, state):
+        acoes, mao, livres, ponta1, ponta2 = percepcao(game, state)
+        moves = gera_moves(mao, ponta1, ponta2)
+        if len(moves) == 1 or not livres:
+            return acoes.get(moves[0], next(iter(acoes.values())))
+        tamanhos, faltam = restricoes(game, state)
+        inicio = time.time()
+        tarefas = [(mao, livres, tamanhos, faltam, ponta1, ponta2, state.to_move, self.iterations,
+                    self.budget, self.rollout, self.c, self.rng.getrandbits(32))
+                   for j in range(max(self.processes, 1))]
+        if self.processes > 1:
+            if self.pool is None:
+                self.pool = Pool(self.processes)
+            resultados = self.pool.map(_ismcts, tarefas)
+        else:
+            resultados = [ismcts(*tarefa) for tarefa in tarefas]
+        self.raiz = merge_roots([raiz for raiz, n in resultados])
+        gasto = time.time() - inicio
+        feitas = sum(n for raiz, n in resultados)
+        self.iterations_per_sec = feitas / gasto if gasto > 0 else 0.0
+        escolha = max(moves, key=lambda m: self.raiz.get(m, (0, 0)))
+        return acoes.get(escolha, next(iter(acoes.values())))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def merge_roots(raizes):
+    """Add up the (visits, wins) of each root move over several trees."""
+    total = {}
+    for raiz in raizes:
+        for move, (visitas, vitorias) in raiz.items():
+            v, w = total.get(move, (0, 0))
+            total[move] = (v + visitas, w + vitorias)
+    return total
@@ -5,10 +5,11 @@ states are laid out in a 2-dimensional grid.  We also represent a policy
 as a dictionary of {state:action} pairs, and a Utility function as a
 dictionary of {state:number} pairs.  We then define the value_iteration
 and policy_iteration algorithms."""
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from utils import argmax, vector_add, print_table
 from grid import orientations, turn_right, turn_left
 from domino import Domino,GameState
+import numpy as np
 import random
 from collections import namedtuple
 
@@ -54,11 +55,31 @@ class MDP:
             return self.actlist
 
 
+def canonical(state):
+    """LearningState of a GameState: both tile lists sorted by pip sum and
+    value, and the open ends as a (high, low) pair."""
+    pedras = tuple(sorted([pedra.tupla() for pedra in state.pedras], key=lambda x: (x[0] + x[1], x)))
+    pedras_restantes = tuple(sorted([pedra.tupla() for pedra in state.pedras_restantes],
+                                    key=lambda x: (x[0] + x[1], x)))
+    pontas = ()
+    if state.ponta1 is not None:
+        p1 = state.ponta1.position
+        p2 = state.ponta2.position
+        if p1 != -1:
+            ponta1, ponta2 = state.ponta1.valor[p1], state.ponta2.valor[p2]
+        else:
+            ponta1, ponta2 = state.ponta1.tupla()
+        pontas = (ponta1, ponta2) if ponta1 > ponta2 else (ponta2, ponta1)
+    return LearningState(pedras=pedras, pedras_restantes=pedras_restantes, pontas=pontas)
+
+
 class DominoMDP(MDP):
 
-    def __init__(self,domino, player, gamma=.9):
+    def __init__(self,domino, player, gamma=.9, memo_size=4096):
         self.domino = domino
         self.player = player
+        self.memo = OrderedDict()
+        self.memo_size = memo_size
         MDP.__init__(self, self.convert(domino.initial), actlist=orientations,
                      terminals=[], gamma=gamma)
         self.init = domino.initial
@@ -73,43 +94,39 @@ class DominoMDP(MDP):
         return self.reward[s]
 
     def T(self, state, action):
+        if action is None:
+            return [(0.0, state)]
         if state.to_move == self.player:
             return [(1, self.domino.result(state, action, self.player))]
         else:
-            return [(1/len(state.pedras_restantes), self.domino.result(state, action, state.to_move))]
-
-    def convert(self,state):
-        pedras = tuple()
-        state.pedras.sort(key=lambda x: (x.valor[0] + x.valor[1]))
-        state.pedras_restantes.sort(key=lambda x: (x.valor[0] + x.valor[1]))
-        for pedra in state.pedras:
-            pedras = pedras + (pedra.tupla(),)
-        pedras_restantes = tuple()
-        for pedra in state.pedras_restantes:
-            pedras_restantes = pedras_restantes + (pedra.tupla(),)
-        ponta1, ponta2 = None, None
-        pontas = ()
-        if state.ponta1 is not None:
-            p1 = state.ponta1.position
-            p2 = state.ponta1.position
-            if p1 != -1:
-                ponta1, ponta2 = state.ponta1.valor[p1],  state.ponta2.valor[p1]
-            else:
-                ponta1, ponta2 = state.ponta1.tupla()
-            if ponta1 > ponta2:
-                pontas = (ponta1, ponta2)
-            else:
-                pontas = (ponta2, ponta1)
-        return LearningState(pedras=pedras, pedras_restantes=pedras_restantes, pontas=pontas)
+            return [(1/len(state.pedras_restantes), self.domino.result(state, action, self.player))]
+
+    def convert(self, state):
+        """Canonical LearningState of a GameState.  The state is left
+        untouched, and the memo_size most recently used results are
+        remembered by the identity of the state, so asking again for the
+        same state is free."""
+        memo = self.memo.get(id(state))
+        if memo is not None and memo[0] is state:
+            self.memo.move_to_end(id(state))
+            return memo[1]
+        s = canonical(state)
+        self.memo[id(state)] = (state, s)
+        if len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+        return s
 
     def actions(self, state):
-        """Set of actions that can be performed in this state.  By default, a
-        fixed list of actions, except for terminal states. Override this
-        method if you need to specialize by state."""
-        if state in self.domino.terminal_test(state):
+        """The moves of the seat to move, or [None] once the game is over."""
+        if self.domino.terminal_test(state):
             return [None]
         else:
-            return self.state.moves
+            return state.moves
+
+    def key(self, state):
+        """Hashable abstraction of a GameState for CompiledMDP: the seat to
+        move and the canonical LearningState."""
+        return state.to_move, self.convert(state)
 
 
 class GridMDP(MDP):
@@ -222,6 +239,125 @@ def policy_evaluation(pi, U, mdp, k=20):
             U[s] = R(s) + gamma * sum([p * U[s1] for (p, s1) in T(s, pi[s])])
     return U
 
+# ______________________________________________________________________________
+
+
+class CompiledMDP:
+
+    """An MDP enumerated once into NumPy arrays, so that value iteration,
+    policy evaluation and best_policy run as sparse matrix-vector products.
+
+    States are mdp.states or, when that is empty, every state reachable
+    from init (mdp.init by default) through actions and T.  key maps a
+    state to a hashable value and states with the same key are merged, which
+    is how an abstraction of the MDP is solved; the first state met with a
+    key stands for all of them.  Every (state, action) pair gets a row and
+    the transitions are kept as coordinate arrays (pair, next state,
+    probability).  Utilities and policies are arrays indexed like
+    self.states; to_dict and policy_dict turn them back into mappings."""
+
+    def __init__(self, mdp, key=None, init=None, max_states=None):
+        key = key or (lambda s: s)
+        self.mdp = mdp
+        self.gamma = mdp.gamma
+        self.states = []
+        self.index = {}
+        representantes = []
+
+        def indice(s):
+            k = key(s)
+            i = self.index.get(k)
+            if i is None:
+                if max_states is not None and len(self.states) >= max_states:
+                    raise ValueError("more than %d states" % max_states)
+                i = self.index[k] = len(self.states)
+                self.states.append(k)
+                representantes.append(s)
+            return i
+
+        for s in (mdp.states or [mdp.init if init is None else init]):
+            indice(s)
+        estado, self.actions, pares, proximos, probs = [], [], [], [], []
+        recompensas = []
+        i = 0
+        while i < len(representantes):
+            s = representantes[i]
+            recompensas.append(mdp.R(s))
+            for a in mdp.actions(s):
+                par = len(estado)
+                estado.append(i)
+                self.actions.append(a)
+                for (p, s1) in mdp.T(s, a):
+                    pares.append(par)
+                    proximos.append(indice(s1))
+                    probs.append(p)
+            i += 1
+        self.R = np.array(recompensas, dtype=np.float64)
+        self.pair_state = np.array(estado, dtype=np.int64)
+        self.pair = np.array(pares, dtype=np.int64)
+        self.next = np.array(proximos, dtype=np.int64)
+        self.prob = np.array(probs, dtype=np.float64)
+        # Pairs are grouped by state, so each state's pairs start here.
+        self.first_pair = np.searchsorted(self.pair_state, np.arange(len(self.states)))
+
+    def q_values(self, U):
+        """Expected next utility of every (state, action) pair."""
+        return np.bincount(self.pair, weights=self.prob * U[self.next], minlength=len(self.pair_state))
+
+    def value_iteration(self, epsilon=0.001, max_iter=None):
+        """Utilities by value iteration, stopping as value_iteration does."""
+        U = np.zeros(len(self.states))
+        n = 0
+        while True:
+            U1 = self.R + self.gamma * np.maximum.reduceat(self.q_values(U), self.first_pair)
+            delta = np.abs(U1 - U).max() if len(U) else 0.0
+            n += 1
+            if delta < epsilon * (1 - self.gamma) / self.gamma or (max_iter is not None and n >= max_iter):
+                return U
+            U = U1
+
+    def best_policy(self, U):
+        """Pair chosen in each state: the first action of highest expected
+        utility, as best_policy picks it."""
+        ordem = np.lexsort((-self.q_values(U), self.pair_state))
+        return ordem[self.first_pair]
+
+    def policy_evaluation(self, pi, U=None, k=20, tol=0.0):
+        """U after k sweeps of policy pi (an array of pairs), or fewer once
+        no utility moves by more than tol."""
+        U = np.zeros(len(self.states)) if U is None else U.copy()
+        escolhido = np.zeros(len(self.pair_state), dtype=bool)
+        escolhido[pi] = True
+        m = escolhido[self.pair]
+        origem, destino, p = self.pair_state[self.pair[m]], self.next[m], self.prob[m]
+        for i in range(k):
+            U1 = self.R + self.gamma * np.bincount(origem, weights=p * U[destino], minlength=len(U))
+            delta = np.abs(U1 - U).max() if len(U) else 0.0
+            U = U1
+            if delta <= tol:
+                break
+        return U
+
+    def policy_iteration(self, k=20, tol=0.0):
+        """Policy iteration from the first action of every state."""
+        pi = self.first_pair.copy()
+        U = np.zeros(len(self.states))
+        while True:
+            U = self.policy_evaluation(pi, U, k, tol)
+            novo = self.best_policy(U)
+            q = self.q_values(U)
+            if np.all(q[novo] <= q[pi]):
+                return pi
+            pi = np.where(q[novo] > q[pi], novo, pi)
+
+    def to_dict(self, U):
+        """{state key: utility}."""
+        return dict(zip(self.states, U.tolist()))
+
+    def policy_dict(self, pi):
+        """{state key: action} of a policy."""
+        return {s: self.actions[p] for s, p in zip(self.states, pi.tolist())}
+
 __doc__ += """
 >>> pi = best_policy(sequential_decision_environment, value_iteration(sequential_decision_environment, .01))
 
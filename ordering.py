@@ -0,0 +1,88 @@
+"""Move ordering for the Board searches.
+
+Alpha-beta prunes best when the strongest move is tried first, so
+alphabeta_search can hand its candidate moves to a MoveOrdering, which
+ranks them by the transposition table move, then the killer moves of the
+ply, then the history table and finally a cheap static score."""
+from collections import defaultdict
+from bitdomino import PEDRAS, NAIPE, conta, joga
+
+
+class MoveOrdering:
+    """Ranks moves at each node and learns from the cutoffs they cause.
+
+    Killer moves are the last moves that caused a cutoff at each ply and are
+    forgotten between searches.  The history table scores (side, tile) by
+    the depth of the cutoffs it caused and lives as long as the object, so
+    one instance should be kept for the moves of a game; it is halved at
+    each new search so old games fade out.  nodes, cutoffs and
+    first_cutoffs count expanded nodes, nodes that were cut off and cutoffs
+    caused by the first move tried."""
+
+    def __init__(self, killers=2, history=True, static=True):
+        self.n_killers = killers
+        self.use_history = history
+        self.use_static = static
+        self.killers = defaultdict(list)
+        self.history = defaultdict(int)
+        self.nodes = 0
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+
+    def nova_busca(self):
+        self.killers.clear()
+        for k in list(self.history):
+            self.history[k] //= 2
+            if not self.history[k]:
+                del self.history[k]
+
+    def static_score(self, board, move):
+        """Doubles first, then high pip totals, then moves that leave an end
+        the mover can still follow."""
+        if move[0] == -1:
+            return -1
+        a, b = PEDRAS[move[0]]
+        mao = board.pedras if board.to_move == board.player else board.pedras_restantes
+        mao &= ~(1 << move[0])
+        ponta1, ponta2 = joga(move[0], board.ponta1, board.ponta2, move[1])
+        if move[1] == -1:
+            retencao = conta(mao & (NAIPE[ponta1] | NAIPE[ponta2]))
+        else:
+            retencao = conta(mao & NAIPE[ponta1 if move[1] == 0 else ponta2])
+        return 20 * (a == b) + a + b + retencao
+
+    def score(self, board, move, ply, hash_move=None):
+        lado = board.to_move == board.player
+        return (move == hash_move,
+                move in self.killers[ply],
+                self.history[lado, move[0]] if self.use_history else 0,
+                self.static_score(board, move) if self.use_static else 0)
+
+    def order(self, board, moves, ply, hash_move=None):
+        """Return moves sorted best first."""
+        self.nodes += 1
+        if len(moves) < 2:
+            return moves
+        return sorted(moves, key=lambda m: self.score(board, m, ply, hash_move), reverse=True)
+
+    def cutoff(self, board, move, ply, restante, indice):
+        """Record that move, tried indice-th, cut off a node at ply."""
+        self.cutoffs += 1
+        if indice == 0:
+            self.first_cutoffs += 1
+        if move[0] == -1:
+            return
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[self.n_killers:]
+        if self.use_history:
+            self.history[board.to_move == board.player, move[0]] += restante * restante
+
+    def cutoff_rate(self):
+        """Fraction of expanded nodes that were cut off."""
+        return self.cutoffs / self.nodes if self.nodes else 0.0
+
+    def first_cutoff_rate(self):
+        """Fraction of cutoffs caused by the first move tried."""
+        return self.first_cutoffs / self.cutoffs if self.cutoffs else 0.0
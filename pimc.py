@@ -0,0 +1,256 @@
+"""Perfect-Information Monte Carlo play.
+
+The player never sees the opponents' hands, only the pool of unseen tiles.
+PIMCPlayer deals that pool to the three opponents many times, keeping each
+hand at its real size and away from the pips its owner is known to lack
+(a seat that passed has nothing matching the ends it passed on), solves
+every deal with all hands face up and plays the move that does best across
+the deals.  Deals can be solved by a pool of worker processes."""
+import random
+import time
+from multiprocessing import Pool
+from bitdomino import (BitGameState, NAIPE, VALOR, avalia, conta, converte_move, gera_moves,
+                       indices, joga, mascara, pontas_abertas, soma)
+from tablebase import abre
+
+infinity = float('inf')
+
+# Value of a won (or lost, negated) deal; far outside the eval range.
+VITORIA = 100
+
+
+def restricoes(game, state):
+    """Hand sizes and masks of the tiles each seat cannot hold, taken from
+    game.historico.  Without a usable history the unseen tiles are split as
+    evenly as possible, earliest seats to move first, and nothing is
+    excluded."""
+    player = state.to_move
+    livres = conta(state.pedras_restantes) if isinstance(state.pedras_restantes, int) else len(state.pedras_restantes)
+    tamanhos = [7] * 4
+    faltam = [0] * 4
+    for jogador, move, ponta1, ponta2 in getattr(game, 'historico', ()):
+        if move[0].valor[0] != -1:
+            tamanhos[jogador] -= 1
+        elif ponta1 is not None:
+            p1, p2 = pontas_abertas(ponta1, ponta2)
+            faltam[jogador] |= NAIPE[p1] | NAIPE[p2]
+    tamanhos[player] = 0
+    if tamanhos[player - 1] + tamanhos[player - 2] + tamanhos[player - 3] != livres:
+        tamanhos = [0] * 4
+        for j in range(livres):
+            tamanhos[(player + 1 + j % 3) % 4] += 1
+        faltam = [0] * 4
+    return tamanhos, faltam
+
+
+def percepcao(game, state):
+    """What the player to move knows of a Domino or BitDomino state: its
+    actions keyed by bitdomino move, its hand and the unseen tiles as masks
+    and the open pips."""
+    if isinstance(state.pedras, list):
+        acoes = {}
+        for a in game.actions(state):
+            acoes.setdefault(converte_move(a), a)
+        ponta1, ponta2 = pontas_abertas(state.ponta1, state.ponta2)
+        return acoes, mascara(state.pedras), mascara(state.pedras_restantes), ponta1, ponta2
+    acoes = {a: a for a in game.actions(state)}
+    return acoes, state.pedras, state.pedras_restantes, state.ponta1, state.ponta2
+
+
+def amostra(rng, livres, tamanhos, faltam, tentativas=50):
+    """Deal the tiles of mask livres to the seats, tamanhos[i] tiles to
+    seat i and none of faltam[i].  Tiles with the fewest possible owners are
+    dealt first, each to a seat drawn in proportion to its free places.
+    When every attempt runs into a dead end the exclusions are dropped."""
+    pedras = indices(livres)
+    for tentativa in range(tentativas + 1):
+        proibidas = faltam if tentativa < tentativas else [0] * 4
+        maos = [0] * 4
+        vagas = list(tamanhos)
+        rng.shuffle(pedras)
+        pedras.sort(key=lambda k: sum(1 for i in range(4) if vagas[i] and not proibidas[i] >> k & 1))
+        for k in pedras:
+            elegiveis = [i for i in range(4) if vagas[i] and not proibidas[i] >> k & 1]
+            if not elegiveis:
+                break
+            i = rng.choices(elegiveis, weights=[vagas[i] for i in elegiveis])[0]
+            maos[i] |= 1 << k
+            vagas[i] -= 1
+        else:
+            return maos
+    return None
+
+
+def vencedor(maos, ponta1, ponta2):
+    """Winner of a deal: a seat with an empty hand or, when no one can
+    play, the first seat with the lowest pip sum; -1 while it goes on."""
+    for i in range(4):
+        if not maos[i]:
+            return i
+    if ponta1 is None:
+        return -1
+    alvo = NAIPE[ponta1] | NAIPE[ponta2]
+    for mao in maos:
+        if mao & alvo:
+            return -1
+    somas = [soma(mao) for mao in maos]
+    return somas.index(min(somas))
+
+
+def _ordem(move):
+    return -VALOR[move[0]] if move[0] != -1 else 0
+
+
+def resolve(maos, ponta1, ponta2, to_move, player, depth, alpha=-infinity, beta=infinity, stats=None,
+            tabela=None):
+    """Paranoid alpha-beta value for player of a deal with every hand known:
+    player maximizes, the other three seats minimize.  Finished deals are
+    worth +-VITORIA and positions depth moves away the eval of player.
+    Positions covered by the Tablebase tabela are worth +-VITORIA too."""
+    if stats is not None:
+        stats[0] += 1
+    moves = sorted(gera_moves(maos[to_move], ponta1, ponta2), key=_ordem)
+    maximiza = to_move == player
+    v = -infinity if maximiza else infinity
+    for move in moves:
+        u = valor_move(maos, ponta1, ponta2, to_move, move, player, depth, alpha, beta, stats, tabela)
+        if maximiza:
+            v = max(v, u)
+            if v >= beta:
+                return v
+            alpha = max(alpha, v)
+        else:
+            v = min(v, u)
+            if v <= alpha:
+                return v
+            beta = min(beta, v)
+    return v
+
+
+def valor_move(maos, ponta1, ponta2, to_move, move, player, depth, alpha=-infinity, beta=infinity, stats=None,
+               tabela=None):
+    """resolve of the deal after to_move plays move.  maos is changed in
+    place and restored before returning."""
+    mao = maos[to_move]
+    if move[0] != -1:
+        maos[to_move] = mao & ~(1 << move[0])
+        ponta1, ponta2 = joga(move[0], ponta1, ponta2, move[1])
+    ganhador = vencedor(maos, ponta1, ponta2)
+    vence = None
+    if ganhador == -1 and tabela is not None:
+        vence = tabela.probe(maos, ponta1, ponta2, (to_move + 1) % 4)
+    if ganhador != -1:
+        v = VITORIA if ganhador == player else -VITORIA
+    elif vence is not None:
+        v = VITORIA if vence >> player & 1 else -VITORIA
+    elif depth <= 1:
+        outras = 0
+        for i in range(4):
+            if i != player:
+                outras |= maos[i]
+        v = avalia(BitGameState(to_move=(to_move + 1) % 4, pedras=maos[player], pedras_restantes=outras,
+                                mesa=0, ponta1=ponta1, ponta2=ponta2, moves=None, utility=0), player)
+    else:
+        v = resolve(maos, ponta1, ponta2, (to_move + 1) % 4, player, depth - 1, alpha, beta, stats, tabela)
+    maos[to_move] = mao
+    return v
+
+
+def resolve_deals(deals, ponta1, ponta2, player, moves, depth, tablebase=None):
+    """Exact value of each root move in each deal, and the nodes searched,
+    probing the tablebase file when one is given."""
+    stats = [0]
+    tabela = abre(tablebase) if tablebase else None
+    valores = []
+    for maos in deals:
+        maos = list(maos)
+        valores.append([valor_move(maos, ponta1, ponta2, player, move, player, depth, stats=stats,
+                                   tabela=tabela)
+                        for move in moves])
+    return valores, stats[0]
+
+
+def _resolve_lote(args):
+    return resolve_deals(*args)
+
+
+class PIMCPlayer:
+    """(game, state) player that picks its move from sampled deals.
+
+    Each call deals the unseen tiles up to samples times (the sample
+    budget), stopping early once budget seconds have passed, and solves
+    every deal depth moves deep.  With voto the move that is best in the
+    most deals wins; otherwise the move with the best mean value.  With
+    processes > 1 the deals are solved in a multiprocessing pool, in chunks
+    of lote deals; call close() when done.  tablebase is the path of a file
+    written by tablebase.generate whose endgames replace the search.
+    samples_per_sec is the rate of the last call and samples, nodes and
+    seconds add up over all calls."""
+
+    def __init__(self, samples=64, depth=8, budget=None, voto=False, processes=1, lote=8, seed=None,
+                 tablebase=None):
+        self.n_samples = samples
+        self.depth = depth
+        self.budget = budget
+        self.voto = voto
+        self.processes = processes
+        self.lote = lote
+        self.tablebase = tablebase
+        self.rng = random.Random(seed)
+        self.pool = None
+        self.samples_per_sec = 0.0
+        self.samples = 0
+        self.nodes = 0
+        self.seconds = 0.0
+
+    def __call__(self, game, state):
+        acoes, mao, livres, ponta1, ponta2 = percepcao(game, state)
+        moves = gera_moves(mao, ponta1, ponta2)
+        if len(moves) == 1 or not livres:
+            return acoes.get(moves[0], next(iter(acoes.values())))
+
+        player = state.to_move
+        tamanhos, faltam = restricoes(game, state)
+        inicio = time.time()
+        deadline = None if self.budget is None else inicio + self.budget
+        somas = [0.0] * len(moves)
+        votos = [0] * len(moves)
+        n = 0
+        while n < self.n_samples and (deadline is None or time.time() < deadline):
+            lotes = []
+            for j in range(max(self.processes, 1)):
+                deals = []
+                while len(deals) < self.lote and n + len(deals) < self.n_samples:
+                    maos = amostra(self.rng, livres, tamanhos, faltam)
+                    maos[player] = mao
+                    deals.append(maos)
+                if deals:
+                    lotes.append((deals, ponta1, ponta2, player, moves, self.depth, self.tablebase))
+                    n += len(deals)
+            if self.processes > 1:
+                if self.pool is None:
+                    self.pool = Pool(self.processes)
+                resultados = self.pool.map(_resolve_lote, lotes)
+            else:
+                resultados = [resolve_deals(*lote) for lote in lotes]
+            for valores, nos in resultados:
+                self.nodes += nos
+                for linha in valores:
+                    melhor = max(linha)
+                    for i, v in enumerate(linha):
+                        somas[i] += v
+                        votos[i] += v == melhor
+        gasto = time.time() - inicio
+        self.samples += n
+        self.seconds += gasto
+        self.samples_per_sec = n / gasto if gasto > 0 else 0.0
+        placar = votos if self.voto else somas
+        escolha = moves[max(range(len(moves)), key=lambda i: (placar[i], somas[i]))]
+        return acoes.get(escolha, next(iter(acoes.values())))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
@@ -1,15 +1,20 @@
 from collections import defaultdict
 from utils import argmax
 from mdp import MDP, policy_evaluation, DominoMDP
-from domino import Domino, imprimestate, GameState,expectiminimax
+from qstore import QStore, salva
+from features import MOVE_FEATURES, move_features
+from domino import Domino, imprimestate, expectiminimax
 from collections import namedtuple
+from multiprocessing import Pipe, Process
+import numpy as np
 import random
-import pickle
+import sys
 import time
 
 def random_player(d, percept):
-    """A player that chooses a legal move at random."""
-    if len(percept.moves) > 0:
+    """A player that chooses a legal move at random, or None once the game
+    is over, like QLearningAgent, so play_game_mdp can end."""
+    if percept.utility == 0 and len(percept.moves) > 0:
         return random.choice(percept.moves)
     else:
         return None
@@ -18,8 +23,11 @@ class QLearningAgent:
     """ An exploratory Q-learning agent. It avoids having to learn the transition
         model because the Q-value of a state can be related directly to those of
         its neighbors. [Figure 21.8]
+        Q and Nsa can be any mapping that reads missing keys as 0, such as
+        a defaultdict or a qtable.PackedTable.  With a replay.TabularReplay
+        transitions go to its buffer and are learned from in minibatches.
     """
-    def __init__(self, mdp, Ne, Rplus, Q, alpha=None):
+    def __init__(self, mdp, Ne, Rplus, Q, alpha=None, Nsa=None, replay=None):
 
         self.gamma = mdp.gamma
         self.terminals = mdp.terminals
@@ -27,11 +35,12 @@ class QLearningAgent:
         self.Ne = Ne  # iteration limit in exploration function
         self.Rplus = Rplus  # large value to assign before iteration limit
         self.Q = Q
-        self.Nsa = defaultdict(float)
+        self.Nsa = defaultdict(float) if Nsa is None else Nsa
         self.s = [None, None, None, None]
         self.a = [None, None, None, None]
         self.r = [None, None, None, None]
         self.mdp = mdp
+        self.replay = replay
 
         if alpha:
             self.alpha = alpha
@@ -59,17 +68,23 @@ class QLearningAgent:
         s1, r1 = self.update_state(percept)
         Q, Nsa, s, a, r = self.Q, self.Nsa, self.s[percept.to_move], self.a[percept.to_move], self.r[percept.to_move]
         alpha, gamma, terminals, actions_in_state = self.alpha, self.gamma, self.terminals, self.actions_in_state
+        c1 = self.mdp.convert(s1)
         if s1.utility != 0:
-            Q[self.mdp.convert(s1), None] = r1
+            Q[c1, None] = r1
         if s is not None:
-            Nsa[self.mdp.convert(s),  convertaction(a)] += 1
-            Q[self.mdp.convert(s), convertaction(a)] += alpha(Nsa[self.mdp.convert(s), convertaction(a)]) * (r + gamma * max(Q[self.mdp.convert(s1), convertaction(a1)] for a1 in actions_in_state(s1))
-                                             - Q[self.mdp.convert(s), convertaction(a)])
+            sa = self.mdp.convert(s), convertaction(a)
+            Nsa[sa] += 1
+            if self.replay is None:
+                Q[sa] += alpha(Nsa[sa]) * (r + gamma * max(Q[c1, convertaction(a1)] for a1 in actions_in_state(s1))
+                                           - Q[sa])
+            else:
+                self.replay.add(sa, r, c1, [convertaction(a1) for a1 in actions_in_state(s1)])
+                self.replay.learn(self)
         if s1.utility != 0:
             self.s[percept.to_move] = self.a[percept.to_move] = self.r[percept.to_move] = None
         else:
             self.s[percept.to_move], self.r[percept.to_move] = s1, r1
-            self.a[percept.to_move] = argmax(actions_in_state(s1), key=lambda a1: self.f(Q[self.mdp.convert(s1), convertaction(a1)], Nsa[self.mdp.convert(s1), convertaction(a1)]))
+            self.a[percept.to_move] = argmax(actions_in_state(s1), key=lambda a1: self.f(Q[c1, convertaction(a1)], Nsa[c1, convertaction(a1)]))
         return self.a[percept.to_move]
 
     def update_state(self, percept):
@@ -77,6 +92,87 @@ class QLearningAgent:
         assumes the percept to be of type (state, reward)'''
         return percept,self.mdp.R(percept)
 
+class LinearQAgent:
+    """Approximate Q-learning agent: Q(s, a) is the dot product of the
+    weights w with features.move_features of a, so memory stays constant
+    and a decision costs one small matrix-vector product.  Plays the move
+    of highest Q, or a random one with probability epsilon.  After each
+    move of a seat, w moves along the TD error of that seat's previous
+    move; when the game is over every seat's last move is pulled towards the
+    utility of a win (4) or a loss (-1).  alpha is a number or a function of
+    the number of updates so far.  With a replay.LinearReplay the TD steps
+    are taken on minibatches of its buffer instead.  Called like
+    QLearningAgent.  [Section 21.4]"""
+
+    def __init__(self, mdp, alpha=0.01, epsilon=0.1, w=None, seed=None, replay=None):
+        self.mdp = mdp
+        self.gamma = mdp.gamma
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.w = np.zeros(len(MOVE_FEATURES)) if w is None else np.array(w, dtype=np.float64)
+        self.rng = random.Random(seed)
+        self.replay = replay
+        self.updates = 0
+        self.jogo = None
+        self.phi = [None, None, None, None]
+        self.r = [None, None, None, None]
+
+    def taxa(self):
+        return self.alpha(self.updates) if callable(self.alpha) else self.alpha
+
+    def update(self, phi, alvo):
+        """One TD step of Q(phi) towards alvo."""
+        self.w += self.taxa() * (alvo - phi @ self.w) * phi
+        self.updates += 1
+
+    def update_batch(self, X, alvos, pesos=None):
+        """One averaged TD step for the rows of X towards alvos, each
+        weighted by pesos when given."""
+        erros = alvos - X @ self.w
+        if pesos is not None:
+            erros = erros * pesos
+        self.w += self.taxa() * X.T @ erros / len(alvos)
+        self.updates += 1
+
+    def aprende(self, phi, r, X=None, final=0.0):
+        """TD step of the move phi that earned r, followed by the moves X,
+        or by the end of the game with the given final value."""
+        if self.replay is not None:
+            self.replay.add(phi, r, X, final)
+            self.replay.learn(self)
+        else:
+            self.update(phi, r + self.gamma * (final if X is None else (X @ self.w).max()))
+
+    def q_values(self, state):
+        """Q of every move of a GameState, and their feature matrix."""
+        X = move_features(state)
+        return X @ self.w, X
+
+    def __call__(self, d, percept):
+        if d is not self.jogo:
+            self.jogo = d
+            self.phi = [None, None, None, None]
+        seat = percept.to_move
+        vencedor = d.vitoria(percept)
+        if vencedor != -1 or not percept.moves:
+            for i in range(4):
+                if self.phi[i] is not None:
+                    self.aprende(self.phi[i], self.r[i], final=4 if i == vencedor else -1)
+            self.phi = [None, None, None, None]
+            return None
+        # DominoMDP.R, without recording the state in mdp.reward.
+        r1 = percept.utility or -0.1
+        q, X = self.q_values(percept)
+        if self.phi[seat] is not None:
+            self.aprende(self.phi[seat], self.r[seat], X)
+        if self.rng.random() < self.epsilon:
+            k = self.rng.randrange(len(q))
+        else:
+            k = int(q.argmax())
+        self.phi[seat], self.r[seat] = X[k], r1
+        return percept.moves[k]
+
+
 def convertaction(a):
     if a is not None:
         return a[0].tupla(), a[1]
@@ -114,27 +210,11 @@ def run_single_trial(agent_program, mdp):
 def play_game_mdp(mdp,*players):
     d = Domino()
     state = d.initial
-    k = 0
     while True:
         for player in players:
             move = player(d,state)
             if move is not None:
-                if move[0].valor[0] != -1:
-                    d.jogadores[state.to_move].remove(move[0])
-                state_res = d.result(state, move, state.to_move)
-                ponta1 = state_res.ponta1
-                ponta2 = state_res.ponta2
-                to_move = state_res.to_move
-                pedras_restantes = []
-                for i in range(4):
-                    if i != to_move:
-                        pedras_restantes += d.jogadores[i]
-
-                state = GameState(to_move=to_move, pedras=d.jogadores[to_move].copy(),
-                                  pedras_restantes=pedras_restantes, ponta1=ponta1, ponta2=ponta2,
-                                  moves=d.moves(to_move, d.jogadores[to_move], pedras_restantes, ponta1, ponta2,
-                                                to_move),
-                                  utility=state_res.utility)
+                vencedor, state = d.avanca(state, move, recalcula=False)
             else:
                 vencedor = d.vitoria(state)
                 if vencedor != -1:
@@ -142,43 +222,169 @@ def play_game_mdp(mdp,*players):
 
 
 
+def alpha_padrao(n):
+    """Learning rate used for training; a module function so it pickles."""
+    return 60./(59+n)
 
-if __name__ == '__main__':
-    domino_decision_environment = DominoMDP(Domino(), 0)
-    q_agent = QLearningAgent(domino_decision_environment, Ne=5, Rplus=4,Q=defaultdict(float), alpha=lambda n: 60./(59+n))
-    #current_reward = domino_decision_environment.R(domino_decision_environment.init)
-    #percept = (domino_decision_environment.init, current_reward)
-    #print(q_agent(percept))
-    for i in range(3000):
-        play_game_mdp(domino_decision_environment, q_agent, q_agent, q_agent, q_agent)
+class TabelaRegistrada(defaultdict):
+    """defaultdict that remembers the value each key had before its first
+    write since the last reset(), so a worker can send back only changes.
+    Reading a missing key returns the default without storing it, so reads
+    are never taken for writes."""
+
+    def __init__(self, *args):
+        defaultdict.__init__(self, *args)
+        self.antigos = {}
+
+    def __missing__(self, key):
+        return self.default_factory()
+
+    def __setitem__(self, key, value):
+        if key not in self.antigos:
+            self.antigos[key] = dict.get(self, key)
+        defaultdict.__setitem__(self, key, value)
+
+    def alterados(self):
+        return {k: self[k] for k, v in self.antigos.items() if v != self[k]}
+
+    def reset(self):
+        self.antigos = {}
+
+def treina_worker(conexao, seed, Ne, Rplus, alpha):
+    """Worker process: keeps a local agent, and for every (values, counts,
+    games) message applies the master's merged changes, plays games of
+    self-play from its own seeded deals and replies with the values it
+    changed, the visits it made and the wins by seat.  None stops it."""
+    random.seed(seed)
+    np.random.seed(seed)
+    mdp = DominoMDP(Domino(), 0)
+    agent = QLearningAgent(mdp, Ne=Ne, Rplus=Rplus, Q=TabelaRegistrada(float), alpha=alpha)
+    agent.Nsa = TabelaRegistrada(float)
+    while True:
+        mensagem = conexao.recv()
+        if mensagem is None:
+            break
+        valores, contagens, games = mensagem
+        dict.update(agent.Q, valores)
+        dict.update(agent.Nsa, contagens)
+        agent.Q.reset()
+        agent.Nsa.reset()
+        wins = [0, 0, 0, 0]
+        for i in range(games):
+            wins[play_game_mdp(mdp, agent, agent, agent, agent)] += 1
+        visitas = {k: n - (agent.Nsa.antigos[k] or 0) for k, n in agent.Nsa.alterados().items()}
+        conexao.send((agent.Q.alterados(), visitas, wins))
+    conexao.close()
+
+def merge_tables(Q, Nsa, resultados):
+    """Merge worker results into the master tables.  Each key becomes the
+    average of the workers' values weighted by the visits each made this
+    round, so a worker that did not visit a key adds nothing to it; keys
+    nobody visited, like terminal states, get the plain average of the
+    values written.  Returns the merged keys and their mean absolute
+    change."""
+    soma = defaultdict(float)
+    peso = defaultdict(float)
+    sem_visita = defaultdict(list)
+    for valores, visitas, wins in resultados:
+        for k, v in valores.items():
+            w = visitas.get(k, 0)
+            if w:
+                soma[k] += w * v
+                peso[k] += w
+            else:
+                sem_visita[k].append(v)
+        for k, n in visitas.items():
+            Nsa[k] += n
+    for k, vs in sem_visita.items():
+        if k not in peso:
+            soma[k] = sum(vs)
+            peso[k] = len(vs)
+    variacao = 0.0
+    for k in soma:
+        novo = soma[k] / peso[k]
+        variacao += abs(novo - Q.get(k, 0.0))
+        Q[k] = novo
+    return set(soma), variacao / len(soma) if soma else 0.0
+
+def train_parallel(workers=4, games=3000, merge_every=100, seed=0, Ne=5, Rplus=4, alpha=alpha_padrao,
+                   checkpoint=None, checkpoint_every=10):
+    """Q-learning self-play on several processes.  Every round each worker
+    plays merge_every games from its own seeded deals and the results are
+    merged into the master tables with merge_tables; only the merged
+    entries are sent back to the workers.  With a checkpoint path, the
+    entries merged in the last checkpoint_every rounds are written to that
+    qstore.QStore as a delta.  Prints one progress line per merge and
+    returns the master QLearningAgent."""
+    mdp = DominoMDP(Domino(), 0)
+    agent = QLearningAgent(mdp, Ne=Ne, Rplus=Rplus, Q=defaultdict(float), alpha=alpha)
+    conexoes = []
+    processos = []
+    for w in range(workers):
+        mestre, filho = Pipe()
+        processo = Process(target=treina_worker, args=(filho, seed + w, Ne, Rplus, alpha), daemon=True)
+        processo.start()
+        conexoes.append(mestre)
+        processos.append(processo)
+    jogados = 0
+    rodada = 0
+    valores, contagens = {}, {}
+    store = QStore(checkpoint) if checkpoint else None
+    sujos = set()
+    inicio = time.time()
+    try:
+        while jogados < games:
+            n = min(merge_every, -(-(games - jogados) // workers))
+            for conexao in conexoes:
+                conexao.send((valores, contagens, n))
+            resultados = [conexao.recv() for conexao in conexoes]
+            chaves, variacao = merge_tables(agent.Q, agent.Nsa, resultados)
+            valores = {k: agent.Q[k] for k in chaves}
+            contagens = {k: agent.Nsa[k] for k in set().union(*(r[1] for r in resultados))}
+            jogados += n * workers
+            rodada += 1
+            wins = [sum(r[2][i] for r in resultados) for i in range(4)]
+            tempo = time.time() - inicio
+            print("Merge: ", rodada, " Jogos: ", jogados, " Tabela: ", len(agent.Q), " Delta Q: ", round(variacao, 4),
+                  " Wins: ", wins, " Jogos/s: ", round(jogados / tempo, 1))
+            if store is not None:
+                sujos |= chaves
+                sujos.update(contagens)
+                if rodada % checkpoint_every == 0 or jogados >= games:
+                    store.atualiza(agent.Q, agent.Nsa, sujos)
+                    store.checkpoint()
+                    sujos = set()
+    finally:
+        for conexao in conexoes:
+            conexao.send(None)
+        for processo in processos:
+            processo.join()
+    return agent
 
-    v0 = 0
-    v1 = 0
+if __name__ == '__main__':
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    if workers > 1:
+        q_agent = train_parallel(workers, games=3000)
+        domino_decision_environment = q_agent.mdp
+    else:
+        domino_decision_environment = DominoMDP(Domino(), 0)
+        q_agent = QLearningAgent(domino_decision_environment, Ne=5, Rplus=4,Q=defaultdict(float), alpha=alpha_padrao)
+        #current_reward = domino_decision_environment.R(domino_decision_environment.init)
+        #percept = (domino_decision_environment.init, current_reward)
+        #print(q_agent(percept))
+        for i in range(3000):
+            play_game_mdp(domino_decision_environment, q_agent, q_agent, q_agent, q_agent)
 
+    from tournament import Tournament
     print(len(q_agent.Q))
-    wins = [0, 0, 0, 0]
-    graphs = [[],[],[],[]]
-    media = 0.0
-    i = 0
-    file = open("res.txt", "a")
-    for i in range(200):
-        print("Iteracao: ", i)
-        inicio1 = time.time()
-        v = play_game_mdp(domino_decision_environment, q_agent, expectiminimax, random_player, random_player)
-        fim1 = time.time()
-        t = (fim1 - inicio1)/60
-        media += t/200
-        wins[v] += 1
-        print("Tempo: ", t)
-        print("Wins: ", wins)
-        for agent in [0, 1, 2, 3]:
-            graphs[agent].append((i, wins[agent]))
-        file.write("i: " + str(i))
-        file.write(str(graphs) + "\n")
-    print("Tempo: ", media*200)
-    print("Tempo médio: ", media)
-    print("Wins: ", wins)
-    print(graphs)
+    jogadores = [('qlearning', q_agent), ('expectiminimax', expectiminimax), ('random1', random_player),
+                 ('random2', random_player)]
+    with Tournament(domino_decision_environment, jogadores, out='res.jsonl', rotate=False) as torneio:
+        resumo = torneio.run(200, callback=lambda r: print("Jogo: ", r['game'], " Vencedor: ", r['winner'],
+                                                           " Tempo: ", r['duration']))
+    print("Wins: ", resumo['seat_wins'])
+    for nome, linha in resumo['players'].items():
+        print(nome, linha)
     """
     U = defaultdict(lambda: -1000.)  # Very Large Negative Value for Comparison see below.
     for state_action, value in q_agent.Q.items():
@@ -188,7 +394,4 @@ if __name__ == '__main__':
     print(U)
     """
 
-    """
-   with open('q_data.txt', 'wb') as output:
-        pickle.dump(q_agent.Q, output, pickle.HIGHEST_PROTOCOL)
-    """
+    salva('q_data.qs', q_agent.Q, q_agent.Nsa)
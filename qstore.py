@@ -0,0 +1,232 @@
+"""Q-tables on disk.
+
+A store file holds n entries sorted by key: a 16-byte header (MAGIC, a
+zero word and n as uint64) followed by the n int64 keys, packed with
+qtable.codifica, their float32 Q values and their uint32 visit counts.
+Files are opened with np.memmap, so loading one costs no more than
+reading its header, and a key is found with np.searchsorted.
+
+QStore keeps one base file and the numbered delta files written after it
+(path.1, path.2, ...), each holding only the entries that changed since
+the previous checkpoint; the newest file that has a key wins.  Its Q and
+Nsa views can be handed to QLearningAgent: writes stay in memory until
+checkpoint() turns them into the next delta, and compact() folds every
+delta back into the base file.
+
+    store = QStore('q.qs')
+    agent = QLearningAgent(mdp, Ne=5, Rplus=4, Q=store.Q, Nsa=store.Nsa)
+    ...
+    store.checkpoint()"""
+import glob
+import os
+import numpy as np
+from qtable import codifica, decodifica
+
+MAGIC = b'DQS1'
+_CABECALHO = 16
+
+
+def escreve(path, codigos, valores, contagens):
+    """Write the entries to path, sorted by key, replacing the file in one
+    step."""
+    codigos = np.asarray(codigos, dtype=np.int64)
+    ordem = np.argsort(codigos, kind='stable')
+    temporario = path + '.tmp'
+    with open(temporario, 'wb') as f:
+        f.write(MAGIC + np.array([0], dtype='<u4').tobytes() + np.array([len(codigos)], dtype='<u8').tobytes())
+        f.write(codigos[ordem].astype('<i8').tobytes())
+        f.write(np.asarray(valores, dtype='<f4')[ordem].tobytes())
+        f.write(np.asarray(contagens, dtype='<u4')[ordem].tobytes())
+    os.replace(temporario, path)
+
+
+def le(path):
+    """(codes, values, counts) of a store file, as read-only memmaps."""
+    with open(path, 'rb') as f:
+        cabecalho = f.read(_CABECALHO)
+    if cabecalho[:4] != MAGIC:
+        raise ValueError('not a Q-store file: %s' % path)
+    n = int(np.frombuffer(cabecalho[8:], dtype='<u8')[0])
+    if n == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.float32), np.zeros(0, np.uint32)
+    return (np.memmap(path, dtype='<i8', mode='r', offset=_CABECALHO, shape=(n,)),
+            np.memmap(path, dtype='<f4', mode='r', offset=_CABECALHO + 8 * n, shape=(n,)),
+            np.memmap(path, dtype='<u4', mode='r', offset=_CABECALHO + 12 * n, shape=(n,)))
+
+
+def salva(path, Q, Nsa=None):
+    """Write the Q and Nsa mappings (dicts keyed by (LearningState, action)
+    or qtable.PackedTables) to path as a new base file, dropping its old
+    deltas."""
+    entradas = _por_codigo(Q)
+    contagens = _por_codigo(Nsa) if Nsa is not None else {}
+    codigos = sorted(set(entradas) | set(contagens))
+    escreve(path, codigos, [entradas.get(c, 0.0) for c in codigos], [contagens.get(c, 0) for c in codigos])
+    for delta in deltas(path):
+        os.remove(delta)
+
+
+def _por_codigo(tabela):
+    if hasattr(tabela, 'codes'):
+        codigos, valores = tabela.codes()
+        return dict(zip(codigos.tolist(), valores.tolist()))
+    return {codifica(k): v for k, v in tabela.items()}
+
+
+def deltas(path):
+    """Delta files of the base file path, oldest first."""
+    numerados = []
+    for nome in glob.glob(glob.escape(path) + '.*'):
+        sufixo = nome[len(path) + 1:]
+        if sufixo.isdigit():
+            numerados.append((int(sufixo), nome))
+    return [nome for n, nome in sorted(numerados)]
+
+
+class QStore:
+    """Q values and visit counts of a store file and its deltas, with the
+    writes made since the last checkpoint held in memory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.partes = []
+        if os.path.exists(path):
+            self.partes = [le(p) for p in [path] + deltas(path)]
+        self.proximo = len(self.partes)
+        self.sujos = {}
+        self.Q = _Coluna(self, 0, 0.0)
+        self.Nsa = _Coluna(self, 1, 0)
+
+    def busca(self, codigo):
+        """(value, count) of a key code, or None when it was never stored."""
+        sujo = self.sujos.get(codigo)
+        if sujo is not None:
+            return sujo
+        for codigos, valores, contagens in reversed(self.partes):
+            i = int(np.searchsorted(codigos, codigo))
+            if i < len(codigos) and codigos[i] == codigo:
+                return float(valores[i]), int(contagens[i])
+        return None
+
+    def get_many(self, codigos, default=0.0):
+        """Q values of an array of key codes, default where missing."""
+        codigos = np.asarray(codigos, dtype=np.int64)
+        res = np.full(len(codigos), default, dtype=np.float64)
+        achados = np.zeros(len(codigos), dtype=bool)
+        for codigos_parte, valores, contagens in reversed(self.partes):
+            if not len(codigos_parte):
+                continue
+            i = np.minimum(np.searchsorted(codigos_parte, codigos), len(codigos_parte) - 1)
+            novo = ~achados & (codigos_parte[i] == codigos)
+            res[novo] = valores[i[novo]]
+            achados |= novo
+        for j, codigo in enumerate(codigos.tolist()):
+            sujo = self.sujos.get(codigo)
+            if sujo is not None:
+                res[j] = sujo[0]
+        return res
+
+    def escreve_entrada(self, codigo, coluna, valor):
+        entrada = self.busca(codigo) or (0.0, 0)
+        self.sujos[codigo] = (valor, entrada[1]) if coluna == 0 else (entrada[0], valor)
+
+    def atualiza(self, Q, Nsa, chaves):
+        """Mark the given (LearningState, action) keys of the Q and Nsa
+        mappings as changed, for tables kept outside the store."""
+        for chave in chaves:
+            self.sujos[codifica(chave)] = (Q.get(chave, 0.0), Nsa.get(chave, 0))
+
+    def codigos(self):
+        """Every stored key code, sorted."""
+        todos = [p[0] for p in self.partes] + [np.array(list(self.sujos), dtype=np.int64)]
+        return np.unique(np.concatenate(todos))
+
+    def __len__(self):
+        return len(self.codigos())
+
+    def checkpoint(self):
+        """Write the entries changed since the last checkpoint as the next
+        delta file and return its path (None when nothing changed)."""
+        if not self.sujos:
+            return None
+        codigos = list(self.sujos)
+        valores = [self.sujos[c][0] for c in codigos]
+        contagens = [self.sujos[c][1] for c in codigos]
+        if not self.partes:
+            destino = self.path
+        else:
+            destino = '%s.%d' % (self.path, self.proximo)
+        escreve(destino, codigos, valores, contagens)
+        self.partes.append(le(destino))
+        self.proximo += 1
+        self.sujos = {}
+        return destino
+
+    def compact(self):
+        """Fold the deltas and the pending writes into a new base file."""
+        codigos = self.codigos()
+        valores = np.zeros(len(codigos), dtype=np.float32)
+        contagens = np.zeros(len(codigos), dtype=np.uint32)
+        for codigos_parte, valores_parte, contagens_parte in self.partes:
+            i = np.searchsorted(codigos, codigos_parte)
+            valores[i] = valores_parte
+            contagens[i] = contagens_parte
+        if self.sujos:
+            sujos = np.array(list(self.sujos), dtype=np.int64)
+            i = np.searchsorted(codigos, sujos)
+            valores[i] = [v for v, c in self.sujos.values()]
+            contagens[i] = [c for v, c in self.sujos.values()]
+        antigos = deltas(self.path)
+        self.partes = []
+        escreve(self.path, codigos, valores, contagens)
+        for delta in antigos:
+            os.remove(delta)
+        self.partes = [le(self.path)]
+        self.proximo = 1
+        self.sujos = {}
+
+    def items(self):
+        """((LearningState, action), value, count) of every entry."""
+        for codigo in self.codigos().tolist():
+            valor, contagem = self.busca(codigo)
+            yield decodifica(codigo), valor, contagem
+
+
+class _Coluna:
+    """Mapping view of the values (coluna 0) or counts (coluna 1) of a
+    QStore, keyed by (LearningState, action); missing keys read as
+    default."""
+
+    def __init__(self, store, coluna, default):
+        self.store = store
+        self.coluna = coluna
+        self.default = default
+
+    def __getitem__(self, chave):
+        entrada = self.store.busca(codifica(chave))
+        return self.default if entrada is None else entrada[self.coluna]
+
+    def __setitem__(self, chave, valor):
+        self.store.escreve_entrada(codifica(chave), self.coluna, valor)
+
+    def __contains__(self, chave):
+        return self.store.busca(codifica(chave)) is not None
+
+    def get(self, chave, default=None):
+        entrada = self.store.busca(codifica(chave))
+        if entrada is None:
+            return self.default if default is None else default
+        return entrada[self.coluna]
+
+    def __len__(self):
+        return len(self.store)
+
+    def keys(self):
+        for chave, valor, contagem in self.store.items():
+            yield chave
+
+    def __iter__(self):
+        return self.keys()
+
+    def values(self):
+        return [entrada[self.coluna + 1] for entrada in self.store.items()]
@@ -0,0 +1,201 @@
+"""Compact Q-table storage keyed by packed integers.
+
+A (LearningState, action) key is packed into one int64: the owner of every
+tile (played, in the hand or in the pool) as a base-3 number below 3**28,
+the pair of open ends (50 values) and the action (88 values: none, or a
+tile or pass on one of the ends).  PackedTable stores these keys and their
+values in NumPy open-addressing arrays behind a dict-like interface, so it
+can replace the defaultdicts of QLearningAgent."""
+import numpy as np
+from bitdomino import INDICE, PEDRAS, N_PEDRAS
+from mdp import LearningState
+
+N_PONTAS = 50
+N_ACOES = 1 + (N_PEDRAS + 1) * 3
+
+_TERNARIO = [[sum(3 ** (7 * c + i) for i in range(7) if m >> i & 1) for m in range(128)] for c in range(4)]
+_FIBONACCI = 0x9E3779B97F4A7C15
+_MASCARA64 = (1 << 64) - 1
+
+
+def ternario(pedras, pedras_restantes):
+    """Base-3 code of the owner of every tile: 1 for the hand, 2 for the pool."""
+    res = 0
+    for c in range(4):
+        res += _TERNARIO[c][pedras >> 7 * c & 0x7f] + 2 * _TERNARIO[c][pedras_restantes >> 7 * c & 0x7f]
+    return res
+
+
+def codifica_estado(s):
+    """Packed code of a LearningState."""
+    pedras = 0
+    for pedra in s.pedras:
+        pedras |= 1 << INDICE[pedra]
+    pedras_restantes = 0
+    for pedra in s.pedras_restantes:
+        pedras_restantes |= 1 << INDICE[pedra]
+    pontas = 1 + s.pontas[0] * 7 + s.pontas[1] if s.pontas else 0
+    return ternario(pedras, pedras_restantes) * N_PONTAS + pontas
+
+
+def codifica_acao(a):
+    """Code of an action as given by convertaction: ((a, b), ponta) or None."""
+    if a is None:
+        return 0
+    return 1 + INDICE.get(a[0], N_PEDRAS) * 3 + a[1] + 1
+
+
+def codifica(chave):
+    """Packed code of a (LearningState, action) key."""
+    return codifica_estado(chave[0]) * N_ACOES + codifica_acao(chave[1])
+
+
+def decodifica(codigo):
+    """(LearningState, action) key of a packed code.  Codes do not depend
+    on the order of the tiles, so they come back sorted by pip sum and then
+    by value."""
+    codigo, acao = divmod(codigo, N_ACOES)
+    codigo, pontas = divmod(codigo, N_PONTAS)
+    pedras, pedras_restantes = [], []
+    for k in range(N_PEDRAS):
+        codigo, dono = divmod(codigo, 3)
+        if dono == 1:
+            pedras.append(PEDRAS[k])
+        elif dono == 2:
+            pedras_restantes.append(PEDRAS[k])
+    pedras.sort(key=lambda x: (x[0] + x[1], x))
+    pedras_restantes.sort(key=lambda x: (x[0] + x[1], x))
+    s = LearningState(pedras=tuple(pedras), pedras_restantes=tuple(pedras_restantes),
+                      pontas=divmod(pontas - 1, 7) if pontas else ())
+    if acao == 0:
+        return s, None
+    k, lado = divmod(acao - 1, 3)
+    return s, (PEDRAS[k] if k < N_PEDRAS else (-1, -1), lado - 1)
+
+
+class PackedTable:
+    """Open-addressing hash table from packed int64 codes to numbers.
+
+    Keys are (LearningState, action) pairs, packed with codifica; missing
+    keys read as default without being inserted.  Slots live in two NumPy
+    arrays (codes, with -1 for empty, and values) probed linearly from a
+    Fibonacci hash, and the arrays double once max_load is reached."""
+
+    VAZIO = -1
+
+    def __init__(self, default=0.0, dtype=np.float64, capacity=1 << 16, max_load=0.6):
+        self.default = default
+        self.dtype = dtype
+        self.max_load = max_load
+        self._aloca(capacity)
+
+    def _aloca(self, capacity):
+        self.bits = max(capacity - 1, 1).bit_length()
+        self.capacity = 1 << self.bits
+        self.mascara = self.capacity - 1
+        self.codigos = np.full(self.capacity, self.VAZIO, dtype=np.int64)
+        self.valores = np.zeros(self.capacity, dtype=self.dtype)
+        self.n = 0
+
+    def _slot(self, codigo):
+        i = ((codigo * _FIBONACCI) & _MASCARA64) >> (64 - self.bits)
+        codigos = self.codigos
+        while True:
+            atual = codigos[i]
+            if atual == codigo or atual == self.VAZIO:
+                return i
+            i = (i + 1) & self.mascara
+
+    def _cresce(self):
+        ocupados = self.codigos != self.VAZIO
+        codigos, valores = self.codigos[ocupados], self.valores[ocupados]
+        self._aloca(self.capacity * 2)
+        for codigo, valor in zip(codigos.tolist(), valores.tolist()):
+            self.set_code(codigo, valor)
+
+    def get_code(self, codigo, default=None):
+        i = self._slot(codigo)
+        if self.codigos[i] == self.VAZIO:
+            return self.default if default is None else default
+        return self.valores[i].item()
+
+    def _slots(self, codigos):
+        """Slot where the probe of each code stops: its own, or the empty
+        slot it would be inserted in."""
+        i = ((codigos.astype(np.uint64) * np.uint64(_FIBONACCI)) >> np.uint64(64 - self.bits)).astype(np.int64)
+        pendentes = np.arange(len(codigos))
+        while len(pendentes):
+            atual = self.codigos[i[pendentes]]
+            pendentes = pendentes[(atual != codigos[pendentes]) & (atual != self.VAZIO)]
+            i[pendentes] = (i[pendentes] + 1) & self.mascara
+        return i
+
+    def get_many(self, codigos, default=None):
+        """Values of an array of codes, probed all at once; missing codes
+        read as default."""
+        codigos = np.asarray(codigos, dtype=np.int64)
+        i = self._slots(codigos)
+        achados = self.codigos[i] == codigos
+        res = np.full(len(codigos), self.default if default is None else default, dtype=np.float64)
+        res[achados] = self.valores[i[achados]]
+        return res
+
+    def set_many(self, codigos, valores):
+        """Set the values of an array of codes.  Codes already stored are
+        written all at once, new ones are inserted one by one; when a code
+        repeats, its last value stays."""
+        codigos = np.asarray(codigos, dtype=np.int64)
+        valores = np.asarray(valores)
+        i = self._slots(codigos)
+        novos = self.codigos[i] == self.VAZIO
+        self.valores[i[~novos]] = valores[~novos]
+        for codigo, valor in zip(codigos[novos].tolist(), valores[novos].tolist()):
+            self.set_code(codigo, valor)
+
+    def set_code(self, codigo, valor):
+        i = self._slot(codigo)
+        if self.codigos[i] == self.VAZIO:
+            if self.n + 1 > self.max_load * self.capacity:
+                self._cresce()
+                i = self._slot(codigo)
+            self.codigos[i] = codigo
+            self.n += 1
+        self.valores[i] = valor
+
+    def __getitem__(self, chave):
+        return self.get_code(codifica(chave))
+
+    def __setitem__(self, chave, valor):
+        self.set_code(codifica(chave), valor)
+
+    def __contains__(self, chave):
+        return self.codigos[self._slot(codifica(chave))] != self.VAZIO
+
+    def get(self, chave, default=None):
+        return self.get_code(codifica(chave), default)
+
+    def __len__(self):
+        return self.n
+
+    def codes(self):
+        """Occupied codes and their values, as arrays."""
+        ocupados = self.codigos != self.VAZIO
+        return self.codigos[ocupados], self.valores[ocupados]
+
+    def items(self):
+        codigos, valores = self.codes()
+        for codigo, valor in zip(codigos.tolist(), valores.tolist()):
+            yield decodifica(codigo), valor
+
+    def keys(self):
+        for chave, valor in self.items():
+            yield chave
+
+    def values(self):
+        return self.codes()[1].tolist()
+
+    def __iter__(self):
+        return self.keys()
+
+    def nbytes(self):
+        return self.codigos.nbytes + self.valores.nbytes
@@ -0,0 +1,189 @@
+"""Experience replay for the Q-learning agents.
+
+ReplayBuffer keeps the last capacity transitions in preallocated NumPy
+arrays, one per field, written in a ring, and samples minibatches of them
+uniformly or, with alpha > 0, in proportion to |TD error| ** alpha (one
+draw in each of batch equal slices of the total), with importance weights
+(N P(i)) ** -beta scaled to a maximum of 1.  A new transition gets the
+highest priority seen so far, so it is replayed at least once soon.
+
+TabularReplay and LinearReplay fill a buffer and train an agent on it:
+given one as replay, QLearningAgent and LinearQAgent hand every
+transition to replay.add instead of learning from it once, and after
+every `every` transitions replay.learn applies one minibatch update with
+a few array operations.
+
+    Q, Nsa = PackedTable(), PackedTable()
+    agent = QLearningAgent(mdp, Ne=5, Rplus=4, Q=Q, Nsa=Nsa, alpha=alpha_padrao,
+                           replay=TabularReplay(100000, alpha=0.6))"""
+import numpy as np
+from features import MOVE_FEATURES
+from qtable import N_ACOES, codifica, codifica_acao, codifica_estado
+
+# Most moves a position can have: seven tiles, each on either end.
+MAX_MOVES = 14
+
+
+class ReplayBuffer:
+    """Ring buffer of transitions.  campos maps each field name to the
+    (shape, dtype) of one transition's value.  Priorities live in a sum
+    tree, an array whose leaves are the priorities and whose every other
+    node is the sum of its two children, so a prioritized minibatch is
+    drawn and updated in log2(capacity) vectorized steps."""
+
+    def __init__(self, capacity, campos, alpha=0.0, beta=0.4, eps=1e-3, seed=None):
+        self.capacity = capacity
+        self.dados = {nome: np.zeros((capacity,) + tuple(forma), dtype=dtype)
+                      for nome, (forma, dtype) in campos.items()}
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.folhas = 1 << max(capacity - 1, 1).bit_length()
+        self.arvore = np.zeros(2 * self.folhas, dtype=np.float64)
+        self.max_prioridade = 1.0
+        self.rng = np.random.default_rng(seed)
+        self.pos = 0
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, nome):
+        return self.dados[nome]
+
+    def _prioriza(self, indices, p):
+        i = np.asarray(indices) + self.folhas
+        self.arvore[i] = p
+        while i[0] > 1:
+            i = np.unique(i >> 1)
+            self.arvore[i] = self.arvore[2 * i] + self.arvore[2 * i + 1]
+
+    def add(self, **valores):
+        """Store one transition, overwriting the oldest once full, and
+        return its index."""
+        i = self.pos
+        for nome, valor in valores.items():
+            self.dados[nome][i] = valor
+        if self.alpha:
+            self._prioriza([i], self.max_prioridade)
+        self.pos = (i + 1) % self.capacity
+        self.n = min(self.n + 1, self.capacity)
+        return i
+
+    def sample(self, batch):
+        """Indices of batch transitions and their importance weights."""
+        if not self.alpha:
+            return self.rng.integers(0, self.n, batch), np.ones(batch)
+        total = self.arvore[1]
+        alvo = (np.arange(batch) + self.rng.random(batch)) * (total / batch)
+        i = np.ones(batch, dtype=np.int64)
+        while i[0] < self.folhas:
+            esquerda = self.arvore[2 * i]
+            direita = alvo >= esquerda
+            alvo -= esquerda * direita
+            i = 2 * i + direita
+        i = np.minimum(i - self.folhas, self.n - 1)
+        pesos = (self.n * self.arvore[i + self.folhas] / total) ** -self.beta
+        return i, pesos / pesos.max()
+
+    def update_priorities(self, indices, erros):
+        """Priorities of the given transitions from their new TD errors."""
+        if not self.alpha:
+            return
+        p = (np.abs(erros) + self.eps) ** self.alpha
+        self._prioriza(indices, p)
+        self.max_prioridade = max(self.max_prioridade, p.max())
+
+
+class _Replay:
+    """Buffer plus the schedule: one minibatch of batch transitions after
+    every `every` transitions added, once the buffer holds batch."""
+
+    def __init__(self, capacity, campos, batch, every, alpha, beta, seed):
+        self.buffer = ReplayBuffer(capacity, campos, alpha, beta, seed=seed)
+        self.batch = batch
+        self.every = every
+        self.passos = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def learn(self, agent):
+        """Count one step and train agent on a minibatch when it is due.
+        Returns the minibatch's TD errors, or None."""
+        self.passos += 1
+        if len(self.buffer) < self.batch or self.passos % self.every:
+            return None
+        indices, pesos = self.buffer.sample(self.batch)
+        erros = self.treina(agent, indices, pesos)
+        self.buffer.update_priorities(indices, erros)
+        return erros
+
+
+class TabularReplay(_Replay):
+    """Replay for QLearningAgent.  A transition is the packed code of
+    (s, a), the reward of s and the codes of every (s1, a1) that follow it,
+    with -1 padding.  Minibatches are read and written with get_many and
+    set_many, so Q and Nsa must have them (qtable.PackedTable); when a key
+    repeats in a minibatch its last update stays."""
+
+    def __init__(self, capacity=100000, batch=32, every=1, alpha=0.0, beta=0.4, seed=None):
+        _Replay.__init__(self, capacity, {'sa': ((), np.int64), 'r': ((), np.float64),
+                                          'seguintes': ((MAX_MOVES,), np.int64)},
+                         batch, every, alpha, beta, seed)
+
+    def add(self, sa, r, s1, actions):
+        """Store the key sa, its reward r and the actions of the next state
+        s1 (a LearningState), as given by convertaction."""
+        estado = codifica_estado(s1) * N_ACOES
+        seguintes = np.full(MAX_MOVES, -1, dtype=np.int64)
+        seguintes[:len(actions)] = [estado + codifica_acao(a) for a in actions]
+        return self.buffer.add(sa=codifica(sa), r=r, seguintes=seguintes)
+
+    def treina(self, agent, indices, pesos):
+        if not hasattr(agent.Q, 'set_many') or not hasattr(agent.Nsa, 'get_many'):
+            raise TypeError('TabularReplay needs Q and Nsa with get_many and set_many')
+        sa = self.buffer['sa'][indices]
+        seguintes = self.buffer['seguintes'][indices]
+        validos = seguintes >= 0
+        q = agent.Q.get_many(sa)
+        q1 = np.full(seguintes.shape, -np.inf)
+        q1[validos] = agent.Q.get_many(seguintes[validos])
+        erros = self.buffer['r'][indices] + agent.gamma * q1.max(axis=1) - q
+        agent.Q.set_many(sa, q + agent.alpha(agent.Nsa.get_many(sa)) * pesos * erros)
+        return erros
+
+
+class LinearReplay(_Replay):
+    """Replay for LinearQAgent.  A transition is the feature row phi of a
+    move, the reward, the feature matrix of the moves that follow it (zero
+    padded, with their number in n) and, for the last move of a game
+    (n == 0), the final value that replaces their maximum."""
+
+    def __init__(self, capacity=50000, batch=32, every=1, alpha=0.0, beta=0.4, seed=None):
+        f = len(MOVE_FEATURES)
+        _Replay.__init__(self, capacity, {'phi': ((f,), np.float32), 'r': ((), np.float64),
+                                          'seguintes': ((MAX_MOVES, f), np.float32), 'n': ((), np.int8),
+                                          'final': ((), np.float64)},
+                         batch, every, alpha, beta, seed)
+
+    def add(self, phi, r, X=None, final=0.0):
+        """Store phi and r with the feature matrix X of the next moves, or
+        with the final value when the game is over (X None)."""
+        seguintes = np.zeros(self.buffer['seguintes'].shape[1:], dtype=np.float32)
+        n = 0
+        if X is not None:
+            n = len(X)
+            seguintes[:n] = X
+        return self.buffer.add(phi=phi, r=r, seguintes=seguintes, n=n, final=final)
+
+    def treina(self, agent, indices, pesos):
+        phi = self.buffer['phi'][indices].astype(np.float64)
+        n = self.buffer['n'][indices]
+        q1 = self.buffer['seguintes'][indices] @ agent.w
+        q1[np.arange(MAX_MOVES) >= n[:, None]] = -np.inf
+        futuro = np.where(n > 0, q1.max(axis=1), self.buffer['final'][indices])
+        alvos = self.buffer['r'][indices] + agent.gamma * futuro
+        erros = alvos - phi @ agent.w
+        agent.update_batch(phi, alvos, pesos)
+        return erros
@@ -0,0 +1,185 @@
+"""Asyncio table server.
+
+Every table is a coroutine playing one Domino game; thousands run side by
+side on one event loop.  A seat is an async player, a coroutine function
+(game, state) -> move:
+
+    local(player)             a (game, state) player run in an executor, so
+                              searches never block the loop
+    local(player, inline=True)
+                              a cheap player called directly
+    RemotePlayer              a client on a socket
+
+play_table bounds every move by a timeout; a move that is late, illegal
+or raises is replaced by the default move (the first legal one).  A player
+run in a thread cannot be stopped, so a late search still finishes in the
+background.
+
+Remote clients speak JSON lines.  The server sends
+
+    {"type": "seated", "table": t, "seat": s}
+    {"type": "turn", "table": t, "turn": n, "state": {...},
+     "moves": [[a, b, lado], ...], "timeout": secs}
+    {"type": "move", "table": t, "seat": s, "move": [a, b, lado]}
+    {"type": "end", "table": t, "winner": w}
+
+and a client answers each turn with {"turn": n, "move": i}, i being the
+index of its choice in moves; answers to turns that timed out are dropped.
+A pass is [-1, -1, lado].  serve() seats the clients in the order they
+connect, remote_seats per table, and fills the other seats with local
+bots:
+
+    python server.py [port] [remote_seats]"""
+import asyncio
+import json
+import sys
+from domino import Domino, pontas_abertas, random_player
+
+
+def first_move(game, state):
+    """Default move: the first legal one."""
+    return state.moves[0]
+
+
+def local(player, executor=None, inline=False):
+    """Async seat for a (game, state) player, run in executor (the loop's
+    default one when None) unless inline."""
+    if inline:
+        async def seat(game, state):
+            return player(game, state)
+    else:
+        async def seat(game, state):
+            return await asyncio.get_running_loop().run_in_executor(executor, player, game, state)
+    return seat
+
+
+def move_json(move):
+    return [move[0].valor[0], move[0].valor[1], move[1]]
+
+
+def state_json(state):
+    """What the seat to move sees of a GameState."""
+    ends = list(pontas_abertas(state.ponta1, state.ponta2)) if state.ponta1 is not None else None
+    return {'to_move': state.to_move, 'hand': [list(p.valor) for p in state.pedras],
+            'unseen': [list(p.valor) for p in state.pedras_restantes], 'ends': ends}
+
+
+async def send(writer, mensagem):
+    writer.write((json.dumps(mensagem) + '\n').encode())
+    await writer.drain()
+
+
+class RemotePlayer:
+    """Seat played by a client on a (reader, writer) stream pair."""
+
+    def __init__(self, reader, writer, timeout=None):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.table = None
+        self.turn = 0
+
+    async def __call__(self, game, state):
+        self.turn += 1
+        await send(self.writer, {'type': 'turn', 'table': self.table, 'turn': self.turn, 'state': state_json(state),
+                                 'moves': [move_json(m) for m in state.moves], 'timeout': self.timeout})
+        while True:
+            linha = await self.reader.readline()
+            if not linha:
+                raise ConnectionError('client left')
+            resposta = json.loads(linha)
+            if resposta.get('turn') == self.turn:
+                return state.moves[resposta['move']]
+
+    async def notify(self, mensagem):
+        await send(self.writer, dict(mensagem, table=self.table))
+
+
+async def choose(seat, game, state, timeout, default):
+    """The move of seat, or default's when it is late, illegal or fails."""
+    try:
+        move = await asyncio.wait_for(seat(game, state), timeout)
+        if move in state.moves:
+            return move
+    except Exception:
+        pass
+    return default(game, state)
+
+
+async def play_table(seats, timeout=5.0, default=first_move, game=None):
+    """Play one game with seats[i] in seat i and return the winner.  Seats
+    with a notify coroutine, like RemotePlayer, are told every move and the
+    result."""
+    d = game or Domino()
+    state = d.initial
+    ouvintes = [s for s in seats if hasattr(s, 'notify')]
+    for i, s in enumerate(seats):
+        if hasattr(s, 'notify'):
+            await s.notify({'type': 'seated', 'seat': i})
+    while True:
+        move = await choose(seats[state.to_move], d, state, timeout, default)
+        vencedor, proximo = d.avanca(state, move, recalcula=False)
+        for s in ouvintes:
+            await s.notify({'type': 'move', 'seat': state.to_move, 'move': move_json(move)})
+        if vencedor != -1:
+            for s in ouvintes:
+                await s.notify({'type': 'end', 'winner': vencedor})
+            return vencedor
+        state = proximo
+
+
+async def play_tables(n, make_seats, timeout=5.0, default=first_move):
+    """Play n tables at once, seated by make_seats(i), and return the
+    winners in order."""
+    return await asyncio.gather(*(play_table(make_seats(i), timeout, default) for i in range(n)))
+
+
+async def serve(host='127.0.0.1', port=8765, remote_seats=1, bots=None, timeout=5.0):
+    """Accept clients and start a table whenever remote_seats of them are
+    waiting; the other seats get local bots (random players by default)."""
+    bots = bots or [local(random_player, inline=True)] * (4 - remote_seats)
+    espera = []
+    mesas = [0]
+
+    async def conecta(reader, writer):
+        jogador = RemotePlayer(reader, writer, timeout)
+        espera.append(jogador)
+        if len(espera) < remote_seats:
+            return
+        remotos = [espera.pop(0) for i in range(remote_seats)]
+        for r in remotos:
+            r.table = mesas[0]
+        mesas[0] += 1
+        try:
+            await play_table(remotos + list(bots), timeout)
+        finally:
+            for r in remotos:
+                r.writer.close()
+
+    servidor = await asyncio.start_server(conecta, host, port)
+    async with servidor:
+        await servidor.serve_forever()
+
+
+async def client(host, port, escolhe):
+    """Play tables as a remote client, answering each turn with
+    escolhe(mensagem), until the server closes the connection.  Returns the
+    winners of the tables played."""
+    reader, writer = await asyncio.open_connection(host, port)
+    vencedores = []
+    while True:
+        linha = await reader.readline()
+        if not linha:
+            break
+        mensagem = json.loads(linha)
+        if mensagem['type'] == 'turn':
+            await send(writer, {'turn': mensagem['turn'], 'move': escolhe(mensagem)})
+        elif mensagem['type'] == 'end':
+            vencedores.append(mensagem['winner'])
+    writer.close()
+    return vencedores
+
+
+if __name__ == '__main__':
+    asyncio.run(serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765,
+                      remote_seats=int(sys.argv[2]) if len(sys.argv) > 2 else 1))
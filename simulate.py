@@ -0,0 +1,143 @@
+"""Vectorized self-play: thousands of independent Domino games advanced in
+lock-step on NumPy arrays.
+
+Each game is four 28-bit hand masks, the two open pips (-1 before the first
+tile), the seat to move and a winner (-1 while the game is running).  A
+policy decides for every game where its seat is to move at once: it gets
+the simulator, the indices of those games and the masks of the tiles they
+can play on each end, and returns the tile indices (-1 to pass) and ends
+chosen."""
+import numpy as np
+from bitdomino import PEDRAS, N_PEDRAS
+from features import NAIPE_ARRAY, batch_eval, expande
+
+_A = np.array([a for (a, b) in PEDRAS], dtype=np.int64)
+_B = np.array([b for (a, b) in PEDRAS], dtype=np.int64)
+_VALOR = _A + _B
+_BITS = np.arange(N_PEDRAS, dtype=np.int64)
+
+
+def candidatos(legal0, legal1):
+    """(N, 56) boolean matrix: column k is tile k on ponta1 (or on the
+    empty table), column 28 + k is tile k on ponta2."""
+    return np.concatenate([(legal0[:, None] >> _BITS) & 1, (legal1[:, None] >> _BITS) & 1], axis=1).astype(bool)
+
+
+def escolhe(scores, validos):
+    """Tile and end of the best valid column of each row, passing when a
+    row has no valid column."""
+    scores = np.where(validos, scores, -np.inf)
+    coluna = scores.argmax(axis=1)
+    passa = ~validos.any(axis=1)
+    return np.where(passa, -1, coluna % N_PEDRAS), np.where(passa, -1, coluna // N_PEDRAS)
+
+
+def random_policy(sim, jogos, legal0, legal1):
+    """Uniformly random legal move."""
+    validos = candidatos(legal0, legal1)
+    return escolhe(sim.rng.random(validos.shape), validos)
+
+
+def greedy_policy(sim, jogos, legal0, legal1):
+    """Legal move whose resulting position has the best eval for the mover."""
+    validos = candidatos(legal0, legal1)
+    linha, coluna = np.nonzero(validos)
+    if not len(linha):
+        return escolhe(np.zeros(validos.shape), validos)
+    g = jogos[linha]
+    seat = sim.to_move[g]
+    tile = coluna % N_PEDRAS
+    ponta1, ponta2 = joga(tile, coluna // N_PEDRAS, sim.ponta1[g], sim.ponta2[g])
+    mao = sim.maos[g, seat] & ~(np.int64(1) << tile)
+    restantes = np.bitwise_or.reduce(sim.maos[g], axis=1) & ~sim.maos[g, seat]
+    scores = np.full(validos.shape, -np.inf)
+    scores[linha, coluna] = batch_eval(mao, restantes, ponta1, ponta2, seat)
+    return escolhe(scores, validos)
+
+
+def joga(tile, lado, ponta1, ponta2):
+    """Open ends after placing tiles on the given ends, as bitdomino.joga."""
+    a, b = _A[tile], _B[tile]
+    inicio = ponta1 < 0
+    novo1 = np.where(inicio, a, np.where(lado == 0, np.where(a == ponta1, b, a), ponta1))
+    novo2 = np.where(inicio, b, np.where(lado == 1, np.where(a == ponta2, b, a), ponta2))
+    return novo1, novo2
+
+
+class BatchSimulator:
+    """n Domino games dealt and played together.  play(policies) runs them
+    all to the end with one batched policy per seat and returns the winner
+    of every game; a game is won by emptying a hand or, when blocked, by the
+    first seat with the lowest pip sum, as in Domino.vitoria."""
+
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.deal()
+
+    def deal(self):
+        ordem = np.argsort(self.rng.random((self.n, N_PEDRAS)), axis=1)
+        bits = np.int64(1) << ordem.astype(np.int64)
+        self.maos = np.stack([bits[:, 7 * j:7 * j + 7].sum(axis=1) for j in range(4)], axis=1)
+        self.ponta1 = np.full(self.n, -1, dtype=np.int64)
+        self.ponta2 = np.full(self.n, -1, dtype=np.int64)
+        self.to_move = np.zeros(self.n, dtype=np.int64)
+        self.winner = np.full(self.n, -1, dtype=np.int64)
+        self.n_moves = np.zeros(self.n, dtype=np.int64)
+
+    def ativos(self):
+        return np.nonzero(self.winner < 0)[0]
+
+    def legal(self, jogos):
+        """Masks of the tiles the seat to move can play on each end; a tile
+        holding both pips is on both, unless the two pips are the same."""
+        mao = self.maos[jogos, self.to_move[jogos]]
+        ponta1, ponta2 = self.ponta1[jogos], self.ponta2[jogos]
+        inicio = ponta1 < 0
+        legal0 = np.where(inicio, mao, mao & NAIPE_ARRAY[ponta1])
+        legal1 = np.where(inicio | (ponta1 == ponta2), 0, mao & NAIPE_ARRAY[ponta2])
+        return legal0, legal1
+
+    def apply(self, jogos, tile, lado):
+        """Play the chosen moves (tile -1 passes) and settle finished games."""
+        seat = self.to_move[jogos]
+        joga_pedra = tile >= 0
+        g, t = jogos[joga_pedra], tile[joga_pedra]
+        self.maos[g, seat[joga_pedra]] &= ~(np.int64(1) << t)
+        self.ponta1[g], self.ponta2[g] = joga(t, lado[joga_pedra], self.ponta1[g], self.ponta2[g])
+        self.n_moves[jogos] += 1
+
+        vazia = self.maos[jogos, seat] == 0
+        self.winner[jogos[vazia]] = seat[vazia]
+        aberto = jogos[~vazia]
+        alvo = NAIPE_ARRAY[self.ponta1[aberto]] | NAIPE_ARRAY[self.ponta2[aberto]]
+        bloqueado = ~((self.maos[aberto] & alvo[:, None]) != 0).any(axis=1) & (self.ponta1[aberto] >= 0)
+        fechados = aberto[bloqueado]
+        if len(fechados):
+            somas = (expande(self.maos[fechados].ravel()) @ _VALOR).reshape(-1, 4)
+            self.winner[fechados] = somas.argmin(axis=1)
+        self.to_move[jogos] = (self.to_move[jogos] + 1) % 4
+
+    def step(self, policies):
+        """Advance every running game by one move."""
+        jogos = self.ativos()
+        seats = self.to_move[jogos]
+        for seat in range(4):
+            vez = jogos[seats == seat]
+            if len(vez):
+                legal0, legal1 = self.legal(vez)
+                tile, lado = policies[seat](self, vez, legal0, legal1)
+                self.apply(vez, np.asarray(tile, dtype=np.int64), np.asarray(lado, dtype=np.int64))
+        return len(jogos)
+
+    def play(self, *policies):
+        """Play every game to the end; one policy per seat, or one for all."""
+        if len(policies) == 1:
+            policies = policies * 4
+        while self.step(policies):
+            pass
+        return self.winner
+
+    def wins(self):
+        """Games won by each seat."""
+        return np.bincount(self.winner[self.winner >= 0], minlength=4)
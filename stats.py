@@ -0,0 +1,116 @@
+"""Counters for the Board searches.
+
+alphabeta_search, expectiminimax and star_expectiminimax take an optional
+stats argument; without it they pay only an `is None` test per node.  One
+SearchStats can be handed to many searches: it keeps running totals, a
+record per search and per-depth node and cutoff counts, and optionally the
+time spent in eval, move generation and apply."""
+import time
+from collections import defaultdict
+
+CONTADORES = ('nodes', 'evals', 'terminals', 'cutoffs', 'chance_nodes', 'outcomes')
+
+
+class SearchStats:
+    """Statistics of the searches it is passed to.
+
+    nodes counts the positions entered below the root, leaves included,
+    evals those scored by eval at the depth limit, terminals the finished
+    games reached, cutoffs the alpha-beta (and Star1) cutoffs and
+    chance_nodes the chance nodes expanded into outcomes, whose number is
+    in outcomes.  por_depth
+    maps each ply to its [nodes, cutoffs].  With timing, tempo holds the
+    seconds spent in 'eval', 'moves' and 'result' (Board.apply).  Each
+    finished search appends a dict of its own counts, depth, seconds and
+    effective branching factor to searches and is handed to callback."""
+
+    def __init__(self, timing=False, callback=None):
+        self.timing = timing
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        for nome in CONTADORES:
+            setattr(self, nome, 0)
+        self.por_depth = defaultdict(lambda: [0, 0])
+        self.tempo = {'eval': 0.0, 'moves': 0.0, 'result': 0.0}
+        self.searches = []
+        self._inicio = None
+
+    def node(self, depth):
+        self.nodes += 1
+        self.por_depth[depth][0] += 1
+
+    def cutoff(self, depth):
+        self.cutoffs += 1
+        self.por_depth[depth][1] += 1
+
+    def chance(self, n):
+        self.chance_nodes += 1
+        self.outcomes += n
+
+    def cronometra(self, nome, f):
+        """f, timed into tempo[nome] when timing is on."""
+        if not self.timing:
+            return f
+        tempo = self.tempo
+        relogio = time.perf_counter
+
+        def cronometrada(*args):
+            inicio = relogio()
+            try:
+                return f(*args)
+            finally:
+                tempo[nome] += relogio() - inicio
+        return cronometrada
+
+    def instrumenta(self, board):
+        """Time board.moves and board.apply, when timing is on."""
+        if self.timing:
+            board.moves = self.cronometra('moves', board.moves)
+            board.apply = self.cronometra('result', board.apply)
+
+    def start(self, nome, depth):
+        self._inicio = (nome, depth, time.perf_counter(), {c: getattr(self, c) for c in CONTADORES})
+
+    def finish(self, **extra):
+        """Close the search opened by start and record it."""
+        nome, depth, inicio, antes = self._inicio
+        registro = {c: getattr(self, c) - antes[c] for c in CONTADORES}
+        registro.update(search=nome, depth=depth, seconds=time.perf_counter() - inicio,
+                        ebf=ebf(registro['nodes'], depth), **extra)
+        self.searches.append(registro)
+        self._inicio = None
+        if self.callback is not None:
+            self.callback(registro)
+        return registro
+
+    def ebf(self):
+        """Mean effective branching factor of the recorded searches."""
+        if not self.searches:
+            return 0.0
+        return sum(r['ebf'] for r in self.searches) / len(self.searches)
+
+    def summary(self):
+        """Totals, per-depth counts and time split as a plain dict."""
+        res = {c: getattr(self, c) for c in CONTADORES}
+        res.update(searches=len(self.searches), ebf=self.ebf(),
+                   por_depth={d: list(v) for d, v in sorted(self.por_depth.items())})
+        if self.timing:
+            res['tempo'] = dict(self.tempo)
+        return res
+
+
+def ebf(nodes, depth):
+    """Branching factor b of a uniform tree of the given depth with as many
+    nodes: b + b**2 + ... + b**depth == nodes."""
+    if depth <= 0 or nodes <= 0:
+        return 0.0
+    baixo, alto = 0.0, max(float(nodes), 1.0)
+    for i in range(60):
+        b = (baixo + alto) / 2
+        if sum(b ** k for k in range(1, depth + 1)) < nodes:
+            baixo = b
+        else:
+            alto = b
+    return (baixo + alto) / 2
@@ -0,0 +1,234 @@
+"""Endgame tablebase: every perfect-information position with at most K
+tiles left in the hands, solved exactly and stored in a file that is
+probed through a memory map.
+
+A position is the set of tiles still held, the seat holding each one, the
+two open pips and the seat to move.  Its entry is a 16-bit word with one
+nibble per seat to move; bit P of the nibble is set when seat P wins with
+P maximizing and the other three seats playing against it (the paranoid
+value used by pimc.resolve).  Entries are indexed by the colex rank of the
+tile set, the rank of the owner assignment among those that give every
+seat at least one tile, and the unordered pair of open pips:
+
+    ((rank(tiles) * R[n] + rank(owners)) * 28 + pair(ponta1, ponta2)
+
+so a probe is a handful of table lookups and one read.  Levels are solved
+from n = 4 tiles (one per seat) upwards, each from the one below.  A
+level holds C(28, n) * 4! * S(n, 4) * 28 entries: 27 MB for K = 4 and
+1.3 GB more for K = 5.
+
+    python tablebase.py endgame.tb 4 [processes]"""
+import sys
+from itertools import combinations, product
+from multiprocessing import Pool
+import numpy as np
+from bitdomino import N_PEDRAS, PEDRAS, VALOR
+
+MAGIC = b'DTB1'
+_CABECALHO = 16
+
+_A = np.array([a for (a, b) in PEDRAS], dtype=np.int64)
+_B = np.array([b for (a, b) in PEDRAS], dtype=np.int64)
+_VALOR = np.array(VALOR, dtype=np.int64)
+
+BINOM = np.zeros((N_PEDRAS + 1, 8), dtype=np.int64)
+for _n in range(N_PEDRAS + 1):
+    for _k in range(8):
+        BINOM[_n, _k] = 1 if _k == 0 else (0 if _n < _k else BINOM[_n - 1, _k - 1] + BINOM[_n - 1, _k])
+
+# Unordered pairs of open pips, numbered 0..27.
+PAR = np.zeros((7, 7), dtype=np.int64)
+PARES = [(a, b) for a in range(7) for b in range(7) if a <= b]
+for _i, (_a, _b) in enumerate(PARES):
+    PAR[_a, _b] = PAR[_b, _a] = _i
+N_PARES = len(PARES)
+
+
+def conjuntos(n):
+    """(C(28, n), n) array of the tile sets of size n, ascending, in colex
+    order, so row i has rank i."""
+    linhas = np.array(list(combinations(range(N_PEDRAS), n)), dtype=np.int64)
+    return linhas[np.argsort(rank_conjuntos(linhas))]
+
+
+def rank_conjuntos(linhas):
+    """Colex rank of each row of ascending tile indices."""
+    return sum(BINOM[linhas[:, i], i + 1] for i in range(linhas.shape[1]))
+
+
+def donos(n):
+    """Owner assignments of n tiles that leave no seat empty, as an (R, n)
+    array, and the rank of every base-4 code (-1 when a seat is empty)."""
+    lista = [d for d in product(range(4), repeat=n) if len(set(d)) == 4]
+    rank = np.full(4 ** n, -1, dtype=np.int64)
+    for i, d in enumerate(lista):
+        rank[codigo_donos(d)] = i
+    return np.array(lista, dtype=np.int64).reshape(-1, n), rank
+
+
+def codigo_donos(d):
+    return sum(int(x) * 4 ** i for i, x in enumerate(d))
+
+
+def tamanho(n):
+    return int(BINOM[N_PEDRAS, n]) * donos(n)[0].shape[0] * N_PARES
+
+
+def resolve_bloco(path, n, inicio, fim, offsets):
+    """Solve the tile sets of ranks inicio..fim of level n and write their
+    entries into the file."""
+    linhas = conjuntos(n)[inicio:fim]
+    dono, _ = donos(n)
+    R = dono.shape[0]
+    pedras = np.repeat(linhas, R, axis=0)
+    owners = np.tile(dono, (len(linhas), 1))
+    N = len(pedras)
+    A, B = _A[pedras], _B[pedras]
+    conta = np.stack([(owners == m).sum(axis=1) for m in range(4)], axis=1)
+    somas = np.stack([(_VALOR[pedras] * (owners == m)).sum(axis=1) for m in range(4)], axis=1)
+    bloqueado_vence = np.argmin(somas, axis=1)
+
+    if n > 4:
+        anterior = np.memmap(path, dtype='<u2', mode='r', offset=offsets[n - 1], shape=(tamanho(n - 1),))
+        _, rank_filho = donos(n - 1)
+        R_filho = donos(n - 1)[0].shape[0]
+        filhos = []
+        for j in range(n):
+            resto = np.delete(pedras, j, axis=1)
+            resto_donos = np.delete(owners, j, axis=1)
+            codigo = sum(resto_donos[:, i] * 4 ** i for i in range(n - 1))
+            filhos.append((rank_conjuntos(resto) * R_filho + np.maximum(rank_filho[codigo], 0)) * N_PARES)
+    saida = np.memmap(path, dtype='<u2', mode='r+', offset=offsets[n], shape=(tamanho(n),))
+    base = inicio * R * N_PARES
+
+    for e, (a, b) in enumerate(PARES):
+        casa = [(A == a) | (B == a), ((A == b) | (B == b)) if a != b else np.zeros_like(A, dtype=bool)]
+        pode = np.stack([((owners == m) & (casa[0] | casa[1])).any(axis=1) for m in range(4)], axis=1)
+        jogada = np.zeros((N, 4), dtype=np.int64)
+        for m in range(4):
+            ou = np.zeros(N, dtype=np.int64)
+            e_ = np.full(N, 0xF, dtype=np.int64)
+            proximo = (m + 1) % 4
+            for j in range(n):
+                for lado in (0, 1):
+                    valido = (owners[:, j] == m) & casa[lado][:, j]
+                    if not valido.any():
+                        continue
+                    ponta = a if lado == 0 else b
+                    outra = np.where(A[:, j] == ponta, B[:, j], A[:, j])
+                    novo = PAR[outra, b] if lado == 0 else PAR[a, outra]
+                    if n > 4:
+                        indice = np.where(valido & (conta[:, m] > 1), filhos[j] + novo, 0)
+                        filho = (anterior[indice].astype(np.int64) >> 4 * proximo) & 0xF
+                        filho = np.where(conta[:, m] == 1, 1 << m, filho)
+                    else:
+                        filho = np.full(N, 1 << m, dtype=np.int64)
+                    ou |= np.where(valido, filho, 0)
+                    e_ &= np.where(valido, filho, 0xF)
+            jogada[:, m] = (ou & (1 << m)) | (e_ & ~(1 << m) & 0xF)
+        bloqueado = ~pode.any(axis=1)
+        entrada = np.zeros(N, dtype=np.int64)
+        for m in range(4):
+            valor = np.zeros(N, dtype=np.int64)
+            resolvido = np.zeros(N, dtype=bool)
+            for passo in range(4):
+                s = (m + passo) % 4
+                novo = ~resolvido & pode[:, s]
+                valor[novo] = jogada[novo, s]
+                resolvido |= novo
+            valor = np.where(bloqueado, 1 << bloqueado_vence, valor)
+            entrada |= valor << 4 * m
+        saida[base + np.arange(N) * N_PARES + e] = entrada
+    saida.flush()
+    return fim - inicio
+
+
+def _resolve_bloco(args):
+    return resolve_bloco(*args)
+
+
+def generate(path, k=4, processes=1, bloco=512):
+    """Write the tablebase of all positions with 4..k tiles to path,
+    splitting every level in blocks of tile sets solved by a process
+    pool."""
+    offsets = {}
+    posicao = _CABECALHO + 8 * (k + 1)
+    for n in range(4, k + 1):
+        offsets[n] = posicao
+        posicao += 2 * tamanho(n)
+    with open(path, 'wb') as f:
+        f.write(MAGIC + np.array([k, 0, 0], dtype='<u4').tobytes())
+        f.write(np.array([offsets.get(n, 0) for n in range(k + 1)], dtype='<u8').tobytes())
+        f.truncate(posicao)
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        for n in range(4, k + 1):
+            total = int(BINOM[N_PEDRAS, n])
+            tarefas = [(path, n, i, min(i + bloco, total), offsets) for i in range(0, total, bloco)]
+            if pool is None:
+                for tarefa in tarefas:
+                    _resolve_bloco(tarefa)
+            else:
+                pool.map(_resolve_bloco, tarefas)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class Tablebase:
+    """Read-only tablebase file, probed through np.memmap."""
+
+    def __init__(self, path):
+        cabecalho = np.fromfile(path, dtype=np.uint8, count=_CABECALHO)
+        if bytes(cabecalho[:4]) != MAGIC:
+            raise ValueError('not a tablebase file: %s' % path)
+        self.path = path
+        self.k = int(cabecalho[4:8].view('<u4')[0])
+        offsets = np.fromfile(path, dtype='<u8', count=self.k + 1, offset=_CABECALHO)
+        self.niveis = {}
+        self.ranks = {}
+        for n in range(4, self.k + 1):
+            self.niveis[n] = np.memmap(path, dtype='<u2', mode='r', offset=int(offsets[n]), shape=(tamanho(n),))
+            dono, rank = donos(n)
+            self.ranks[n] = (dono.shape[0], rank.tolist())
+        self.binom = BINOM.tolist()
+        self.par = PAR.tolist()
+
+    def probe(self, maos, ponta1, ponta2, to_move):
+        """Win mask (bit P for seat P) of a position given as four hand
+        masks, or None when it has more than k tiles or an empty table."""
+        todas = maos[0] | maos[1] | maos[2] | maos[3]
+        n = bin(todas).count('1')
+        if n > self.k or n < 4 or ponta1 is None:
+            return None
+        R, rank = self.ranks[n]
+        binom = self.binom
+        s = codigo = i = 0
+        while todas:
+            bit = todas & -todas
+            t = bit.bit_length() - 1
+            s += binom[t][i + 1]
+            dono = 0 if maos[0] & bit else 1 if maos[1] & bit else 2 if maos[2] & bit else 3
+            codigo += dono << 2 * i
+            todas ^= bit
+            i += 1
+        r = rank[codigo]
+        if r < 0:
+            return None
+        return int(self.niveis[n][(s * R + r) * N_PARES + self.par[ponta1][ponta2]]) >> 4 * to_move & 0xF
+
+
+_abertas = {}
+
+
+def abre(path):
+    """Tablebase of path, opened once per process."""
+    if path not in _abertas:
+        _abertas[path] = Tablebase(path)
+    return _abertas[path]
+
+
+if __name__ == '__main__':
+    generate(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+             int(sys.argv[3]) if len(sys.argv) > 3 else 1)
@@ -0,0 +1,22 @@
+import asyncio
+import random
+import numpy as np
+from batch_players import EvalGreedyBatchPlayer, batched, play_batched
+from domino import random_player
+from server import local, play_tables
+
+
+def test_play_batched_smoke():
+    random.seed(0)
+    np.random.seed(0)
+    vencedores = play_batched(4, EvalGreedyBatchPlayer(), *[batched(random_player)] * 3)
+    assert len(vencedores) == 4
+    assert all(0 <= v < 4 for v in vencedores)
+
+
+def test_play_tables_smoke():
+    random.seed(0)
+    np.random.seed(0)
+    vencedores = asyncio.run(play_tables(3, lambda i: [local(random_player, inline=True)] * 4))
+    assert len(vencedores) == 3
+    assert all(0 <= v < 4 for v in vencedores)
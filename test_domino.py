@@ -0,0 +1,158 @@
+import pickle
+import random
+import numpy as np
+import pytest
+from bitdomino import (Board, BitDomino, conta, converte_estado, converte_move, gera_moves, pontas_abertas,
+                       probabilidade, separa_chances)
+from domino import Domino, GameState, Pedra, expectiminimax, star_expectiminimax
+from transposition import chave_zobrist
+
+
+def estado(pool, ponta1, ponta2):
+    d = Domino()
+    moves = d.moves(1, [], pool, ponta1, ponta2, 0)
+    return d, GameState(to_move=1, pedras=[], pedras_restantes=pool, ponta1=ponta1, ponta2=ponta2, moves=moves,
+                        utility=0)
+
+
+def confere(probs):
+    assert all(0 <= p <= 1 for p in probs)
+    assert abs(sum(probs) - 1) < 1e-9
+
+
+def test_chance_probabilities():
+    pool = [Pedra(5, 3, -1), Pedra(3, 1, -1), Pedra(5, 2, -1)]
+    d, state = estado(pool, Pedra(3, 6, 0), Pedra(6, 5, 1))
+    assert len(state.moves) == 4
+    confere([d.probability(c) for c in d.chances(state)])
+    bits = converte_estado(state)
+    moves = gera_moves(bits.pedras_restantes, bits.ponta1, bits.ponta2)
+    confere([probabilidade(c) for c in separa_chances(True, moves, 0, conta(bits.pedras_restantes))])
+
+
+def test_random_chance_probabilities():
+    rng = random.Random(0)
+    todas = [Pedra(a, b, -1) for a in range(7) for b in range(a + 1)]
+    for i in range(500):
+        pool = rng.sample(todas, rng.randint(1, 21))
+        p1, p2 = rng.randrange(7), rng.randrange(7)
+        d, state = estado(pool, Pedra(p1, 0, 0), Pedra(0, p2, 1))
+        confere([d.probability(c) for c in d.chances(state)])
+
+
+def test_state_equals_unpickled_copy():
+    d = Domino()
+    state = d.initial
+    move = state.moves[0]
+    filho = d.result(state, move, 0)
+    copia = pickle.loads(pickle.dumps(filho))
+    assert copia == filho
+    assert filho == copia
+    assert filho[5] == filho.moves
+    assert tuple(filho) == tuple(copia)
+
+
+def test_result_on_legacy_opening_ends():
+    d = Domino()
+    abertura = Pedra(6, 2, -1)
+    pool = [Pedra(6, 4, -1), Pedra(2, 5, -1)]
+    _, state = estado(pool, abertura, abertura)
+    assert pontas_abertas(state.ponta1, state.ponta2) == (6, 2)
+    esquerda = d.result(state, (Pedra(6, 4, -1), 0), 0)
+    assert pontas_abertas(esquerda.ponta1, esquerda.ponta2) == (4, 2)
+    direita = d.result(state, (Pedra(2, 5, -1), 1), 0)
+    assert pontas_abertas(direita.ponta1, direita.ponta2) == (6, 5)
+
+
+def test_chances_agree_for_every_searching_seat():
+    rng = random.Random(1)
+    todas = [Pedra(a, b, -1) for a in range(7) for b in range(a + 1)]
+    bd = BitDomino()
+    for i in range(200):
+        rng.shuffle(todas)
+        mao, pool = todas[:5], todas[5:5 + rng.randint(4, 15)]
+        player, to_move = rng.randrange(4), rng.randrange(4)
+        ponta1, ponta2 = Pedra(rng.randrange(7), 0, 0), Pedra(0, rng.randrange(7), 1)
+        d = Domino()
+        moves = d.moves(to_move, mao, pool, ponta1, ponta2, player)
+        state = GameState(to_move=to_move, pedras=mao, pedras_restantes=pool, ponta1=ponta1, ponta2=ponta2,
+                          moves=moves, utility=0)
+        bits = converte_estado(state)
+        board = Board(bits, player)
+        esperado = [(c[0], c[2], c[3]) for c in d.chances(state, player)]
+        assert [(c[0], c[2], c[3]) for c in board.chances(board.moves())] == esperado
+        bits = bits._replace(moves=gera_moves(board.pedras if to_move == player else board.pedras_restantes,
+                                              bits.ponta1, bits.ponta2))
+        assert [(c[0], c[2], c[3]) for c in bd.chances(bits, player)] == esperado
+
+
+def test_no_pass_on_empty_table():
+    d = Domino()
+    moves = d.initial.moves
+    assert len(moves) == 7
+    assert all(m[0].valor[0] != -1 for m in moves)
+    assert d.moves(1, d.jogadores[0], d.jogadores[1], None, None, 0) == [(p, -1) for p in d.jogadores[1]]
+
+
+def partidas(n, seed=0):
+    """(Domino, GameState) of every position of n random games."""
+    np.random.seed(seed)
+    rng = random.Random(seed)
+    for i in range(n):
+        d = Domino()
+        state = d.initial
+        while True:
+            yield d, state
+            vencedor, state = d.avanca(state, rng.choice(state.moves), recalcula=False)
+            if vencedor != -1:
+                break
+
+
+def test_bitdomino_matches_domino():
+    for d, state in partidas(20):
+        bd = BitDomino(d)
+        bits = converte_estado(state)
+        player = state.to_move
+        moves = bd.moves(player, bits.pedras, bits.pedras_restantes, bits.ponta1, bits.ponta2, player)
+        assert sorted(converte_move(m) for m in state.moves) == sorted(moves)
+        for move in state.moves:
+            filho = d.result(state, move, player)
+            filho_bits = bd.result(bits, converte_move(move), player)
+            assert filho.utility == filho_bits.utility
+            assert converte_estado(filho)[:6] == filho_bits[:6]
+            assert d.vitoria(filho) == bd.vitoria(filho_bits)
+        assert d.eval(state, player) == pytest.approx(bd.eval(bits, player))
+
+
+def test_board_apply_undo_and_zobrist():
+    rng = random.Random(3)
+    for d, state in partidas(5, seed=3):
+        if state.ponta1 is None:
+            continue
+        player = state.to_move
+        board = Board(converte_estado(state), player)
+        inicio = board.state(), board.chave
+        for i in range(6):
+            moves = board.moves()
+            board.apply(rng.choice(moves))
+            assert board.chave == chave_zobrist(board, player)
+            if board.utility != 0:
+                break
+        while board.pilha:
+            board.undo()
+        assert (board.state(), board.chave) == inicio
+
+
+def test_star_matches_expectiminimax():
+    posicoes = [(d, s) for d, s in partidas(30, seed=7)
+                if s.ponta1 is not None and s.utility == 0 and len(s.pedras_restantes) > 3][::7]
+    assert len(posicoes) >= 20
+    iguais = 0
+    for d, state in posicoes:
+        info_star, info = {}, {}
+        move_star = star_expectiminimax(d, state, depth=3, info=info_star)
+        move = expectiminimax(d, state, depth=3, info=info)
+        assert info_star['value'] == pytest.approx(info['value'])
+        iguais += converte_move(move_star) == converte_move(move)
+    # Moves of equal value may be told apart by rounding alone.
+    assert iguais >= 0.95 * len(posicoes)
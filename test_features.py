@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from domino import Domino
+from features import MOVE_FEATURES, batch_eval, empacota, eval_states, move_features
+
+
+def posicoes(n, seed=0):
+    np.random.seed(seed)
+    res = []
+    for i in range(n):
+        d = Domino()
+        state = d.initial
+        while True:
+            res.append((d, state))
+            vencedor, state = d.avanca(state, state.moves[np.random.randint(len(state.moves))], recalcula=False)
+            if vencedor != -1:
+                break
+    return res
+
+
+def test_batch_eval_matches_domino_eval():
+    pares = posicoes(10)
+    states = [s for d, s in pares]
+    for player in range(4):
+        esperado = [d.eval(s, player) for d, s in pares]
+        assert batch_eval(*empacota(states), player) == pytest.approx(esperado)
+    por_estado = [s.to_move for s in states]
+    assert eval_states(states, np.array(por_estado)) == pytest.approx([d.eval(s, s.to_move) for d, s in pares])
+
+
+def test_move_features_shape():
+    for d, state in posicoes(2, seed=1):
+        X = move_features(state)
+        assert X.shape == (len(state.moves), len(MOVE_FEATURES))
+        assert np.all(X[:, -1] == 1)
@@ -0,0 +1,35 @@
+from collections import defaultdict
+from domino import Domino
+from mdp import DominoMDP
+from qlearning import LinearQAgent, TabelaRegistrada, merge_tables, play_game_mdp
+
+
+def test_reads_are_not_merged():
+    chave = ('s', 'a')
+    lido = TabelaRegistrada(float)
+    assert lido[chave] == 0.0
+    assert chave not in lido
+    treinado = TabelaRegistrada(float)
+    treinado[chave] += 2.0
+    visitas = {chave: 3}
+    Q, Nsa = defaultdict(float), defaultdict(float)
+    resultados = [(lido.alterados(), {}, [0] * 4), (treinado.alterados(), visitas, [0] * 4)]
+    merge_tables(Q, Nsa, resultados)
+    assert Q[chave] == 2.0
+    assert Nsa[chave] == 3
+
+
+def test_unvisited_writes_average():
+    Q, Nsa = defaultdict(float), defaultdict(float)
+    merge_tables(Q, Nsa, [({'fim': 4.0}, {}, [0] * 4), ({'fim': 4.0}, {}, [0] * 4)])
+    assert Q['fim'] == 4.0
+
+
+def test_linear_agent_keeps_mdp_rewards_constant():
+    mdp = DominoMDP(Domino(), 0)
+    agent = LinearQAgent(mdp, seed=0)
+    antes = len(mdp.reward)
+    for i in range(5):
+        play_game_mdp(mdp, agent, agent, agent, agent)
+    assert len(mdp.reward) == antes
+    assert agent.updates > 0
@@ -0,0 +1,63 @@
+import numpy as np
+from domino import Domino
+from mdp import DominoMDP
+from qlearning import convertaction
+from qstore import QStore, deltas
+from qtable import PackedTable, codifica, decodifica
+
+
+def chaves(n, seed=0):
+    """Distinct (LearningState, action) keys of the first positions of n
+    deals."""
+    np.random.seed(seed)
+    res = []
+    for i in range(n):
+        d = Domino()
+        mdp = DominoMDP(d, 0)
+        state = d.initial
+        for j in range(6):
+            res.extend((mdp.convert(state), convertaction(m)) for m in state.moves)
+            vencedor, state = d.avanca(state, state.moves[0], recalcula=False)
+            if vencedor != -1:
+                break
+    return list(dict.fromkeys(res))
+
+
+def test_codes_round_trip():
+    for chave in chaves(3):
+        assert codifica(decodifica(codifica(chave))) == codifica(chave)
+
+
+def test_packed_table_round_trip():
+    tabela = PackedTable(capacity=8)
+    todas = chaves(10)
+    for i, chave in enumerate(todas):
+        tabela[chave] = float(i)
+    esperado = {codifica(k): float(i) for i, k in enumerate(todas)}
+    assert len(tabela) == len(esperado)
+    codigos = np.array(list(esperado))
+    assert list(tabela.get_many(codigos)) == list(esperado.values())
+    tabela.set_many(codigos, -np.arange(len(codigos), dtype=float))
+    assert list(tabela.get_many(codigos)) == list(-np.arange(len(codigos), dtype=float))
+    assert tabela.get_many(np.array([-5]), default=7.0)[0] == 7.0
+
+
+def test_qstore_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'q.qs')
+    todas = chaves(4)
+    store = QStore(path)
+    for i, chave in enumerate(todas):
+        store.Q[chave] = i / 4
+        store.Nsa[chave] = i
+    store.checkpoint()
+    store.Q[todas[0]] = 9.5
+    assert store.checkpoint() == path + '.1'
+    for aberto in (QStore(path), store):
+        assert aberto.Q[todas[0]] == 9.5
+        assert aberto.Nsa[todas[0]] == 0
+        for i, chave in enumerate(todas[1:], 1):
+            assert aberto.Q[chave] == i / 4
+            assert aberto.Nsa[chave] == i
+    store.compact()
+    assert deltas(path) == []
+    assert QStore(path).Q[todas[0]] == 9.5
@@ -0,0 +1,157 @@
+"""Tournament runner for play_game_mdp.
+
+Every game is written as one record (game number, the player in each
+seat, the winning seat and player, the moves made and the seconds each
+seat spent choosing them) to a buffered JSONL or CSV file, flushed every
+flush_every games or flush_seconds seconds.  Only running totals are kept
+in memory, so a run of any length has the same footprint; summary() turns
+them into win rates with Wilson confidence intervals and the mean time per
+move of each player."""
+import csv
+import json
+import math
+import time
+from statistics import NormalDist
+from qlearning import play_game_mdp
+
+CAMPOS = ('game', 'seats', 'winner', 'winner_seat', 'moves', 'seconds', 'duration')
+
+
+def wilson(wins, n, confidence=0.95):
+    """Wilson score interval of a win rate of wins in n games."""
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    p = wins / n
+    centro = (p + z * z / (2 * n)) / (1 + z * z / n)
+    margem = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, centro - margem), min(1.0, centro + margem)
+
+
+class _Cronometrado:
+    """Player wrapper counting the moves made and the time spent."""
+
+    def __init__(self, player):
+        self.player = player
+        self.moves = 0
+        self.seconds = 0.0
+
+    def __call__(self, d, state):
+        inicio = time.perf_counter()
+        move = self.player(d, state)
+        self.seconds += time.perf_counter() - inicio
+        if move is not None:
+            self.moves += 1
+        return move
+
+
+class Tournament:
+    """Games of play_game_mdp between named players.
+
+    players is a list of (name, player) pairs, one per seat.  With rotate
+    the players move one seat on after every game, so each sits everywhere
+    equally often.  Records go to out as JSON lines, or as CSV when out ends
+    in .csv (format overrides the guess); without out nothing is written.
+    Use as a context manager, or call close(), so the file is flushed."""
+
+    def __init__(self, mdp, players, out=None, format=None, rotate=True, flush_every=1000, flush_seconds=30.0,
+                 confidence=0.95):
+        if len({nome for nome, player in players}) != len(players):
+            raise ValueError('player names must be unique')
+        self.mdp = mdp
+        self.players = list(players)
+        self.rotate = rotate
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.confidence = confidence
+        self.format = format or ('csv' if out and out.endswith('.csv') else 'jsonl')
+        self.arquivo = None
+        self.escritor = None
+        if out:
+            self.arquivo = open(out, 'w', newline='', buffering=1 << 16)
+            if self.format == 'csv':
+                self.escritor = csv.writer(self.arquivo)
+                self.escritor.writerow(CAMPOS)
+        self.jogos = 0
+        self.pendentes = 0
+        self.ultimo_flush = time.time()
+        self.total = {nome: {'games': 0, 'wins': 0, 'moves': 0, 'seconds': 0.0} for nome, player in players}
+        self.vitorias_assento = [0, 0, 0, 0]
+
+    def assentos(self, jogo):
+        """(name, player) in each seat for the given game."""
+        desloca = jogo % len(self.players) if self.rotate else 0
+        return self.players[desloca:] + self.players[:desloca]
+
+    def play(self):
+        """Play one game, record it and return its record."""
+        assentos = self.assentos(self.jogos)
+        cronometrados = [_Cronometrado(player) for nome, player in assentos]
+        inicio = time.perf_counter()
+        vencedor = play_game_mdp(self.mdp, *cronometrados)
+        duracao = time.perf_counter() - inicio
+        nomes = [nome for nome, player in assentos]
+        registro = {'game': self.jogos, 'seats': nomes, 'winner': nomes[vencedor], 'winner_seat': vencedor,
+                    'moves': [c.moves for c in cronometrados],
+                    'seconds': [round(c.seconds, 6) for c in cronometrados], 'duration': round(duracao, 6)}
+        for nome, c in zip(nomes, cronometrados):
+            total = self.total[nome]
+            total['games'] += 1
+            total['moves'] += c.moves
+            total['seconds'] += c.seconds
+        self.total[nomes[vencedor]]['wins'] += 1
+        self.vitorias_assento[vencedor] += 1
+        self.jogos += 1
+        self.escreve(registro)
+        return registro
+
+    def run(self, games, callback=None):
+        """Play games games, handing each record to callback, and return
+        summary()."""
+        for i in range(games):
+            registro = self.play()
+            if callback is not None:
+                callback(registro)
+        self.flush()
+        return self.summary()
+
+    def escreve(self, registro):
+        if self.arquivo is None:
+            return
+        if self.escritor is not None:
+            self.escritor.writerow([json.dumps(registro[c]) if isinstance(registro[c], list) else registro[c]
+                                    for c in CAMPOS])
+        else:
+            self.arquivo.write(json.dumps(registro) + '\n')
+        self.pendentes += 1
+        if self.pendentes >= self.flush_every or time.time() - self.ultimo_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.arquivo is not None:
+            self.arquivo.flush()
+        self.pendentes = 0
+        self.ultimo_flush = time.time()
+
+    def summary(self):
+        """Games, wins, win rate with its confidence interval, moves and
+        mean seconds per move of each player, and the wins by seat."""
+        res = {'games': self.jogos, 'seat_wins': list(self.vitorias_assento), 'players': {}}
+        for nome, total in self.total.items():
+            n, wins = total['games'], total['wins']
+            res['players'][nome] = {'games': n, 'wins': wins, 'win_rate': wins / n if n else 0.0,
+                                    'ci': wilson(wins, n, self.confidence), 'moves': total['moves'],
+                                    'sec_per_move': total['seconds'] / total['moves'] if total['moves'] else 0.0}
+        return res
+
+    def close(self):
+        if self.arquivo is not None:
+            self.flush()
+            self.arquivo.close()
+            self.arquivo = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,84 @@
+"""Zobrist keys and a fixed-size transposition table for the Board searches.
+
+A position is keyed by the XOR of one random 64-bit word per (owner, tile),
+one per pair of open ends, one for the side to move and one for the player
+the search is run for, so Board can update its key incrementally."""
+import random
+
+EXATO, INFERIOR, SUPERIOR = 0, 1, 2
+
+_gerador = random.Random(0x5EED)
+ZOBRIST_PEDRA = [[_gerador.getrandbits(64) for k in range(28)] for dono in range(2)]
+ZOBRIST_PONTAS = [[_gerador.getrandbits(64) for p2 in range(8)] for p1 in range(8)]
+ZOBRIST_VEZ = [_gerador.getrandbits(64) for i in range(4)]
+ZOBRIST_JOGADOR = [_gerador.getrandbits(64) for i in range(4)]
+ZOBRIST_CHANCE = {c: _gerador.getrandbits(64) for c in (-1, 0, 1, 2)}
+
+
+def chave_pontas(ponta1, ponta2):
+    """Zobrist word of the open ends; index 7 stands for an empty table."""
+    return ZOBRIST_PONTAS[7 if ponta1 is None else ponta1][7 if ponta2 is None else ponta2]
+
+
+def chave_zobrist(state, player):
+    """Full Zobrist key of a BitGameState or Board searched for player."""
+    chave = chave_pontas(state.ponta1, state.ponta2) ^ ZOBRIST_VEZ[state.to_move] ^ ZOBRIST_JOGADOR[player]
+    for k in range(28):
+        if state.pedras >> k & 1:
+            chave ^= ZOBRIST_PEDRA[0][k]
+        elif state.pedras_restantes >> k & 1:
+            chave ^= ZOBRIST_PEDRA[1][k]
+    return chave
+
+
+class TranspositionTable:
+    """A fixed-size table of search results indexed by Zobrist key.
+
+    Every slot holds (chave, valor, profundidade, tipo, move, geracao), where
+    tipo is EXATO, INFERIOR (lower bound) or SUPERIOR (upper bound) and
+    profundidade is the remaining depth the value was searched to.  A slot
+    is kept when the incoming result is shallower and comes from the same
+    search; otherwise it is replaced.  Call nova_busca() before each search."""
+
+    def __init__(self, bits=16):
+        self.tamanho = 1 << bits
+        self.mascara = self.tamanho - 1
+        self.slots = [None] * self.tamanho
+        self.geracao = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def nova_busca(self):
+        self.geracao += 1
+
+    def probe(self, chave):
+        """Return the slot stored for chave, or None."""
+        slot = self.slots[chave & self.mascara]
+        if slot is not None and slot[0] == chave:
+            self.hits += 1
+            return slot
+        self.misses += 1
+        return None
+
+    def store(self, chave, valor, profundidade, tipo, move=None):
+        i = chave & self.mascara
+        slot = self.slots[i]
+        if slot is not None and slot[0] != chave:
+            if slot[5] == self.geracao and slot[2] > profundidade:
+                return
+            self.replacements += 1
+        self.slots[i] = (chave, valor, profundidade, tipo, move, self.geracao)
+        self.stores += 1
+
+    def clear(self):
+        self.slots = [None] * self.tamanho
+        self.hits = self.misses = self.stores = self.replacements = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return sum(1 for slot in self.slots if slot is not None)